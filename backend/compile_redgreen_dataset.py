@@ -0,0 +1,341 @@
+"""
+Ahead-of-time compiler for Red-Green trial datasets.
+
+A dataset folder (e.g. trial_data/ecog_stimuli_v6) holds one pretty-printed
+simulation_data.json per trial plus an optional repeat.csv. This script
+compiles it into a single indexed binary bundle, <dataset folder>.bundle,
+next to the folder:
+
+    magic (8 bytes) | index length (uint64 LE) | index (UTF-8 JSON) | pad to 8 bytes
+    frames (int32 LE, all trials) | pad to 8 bytes | x (float64 LE) | y (float64 LE)
+
+The index records, per trial folder, the parsed trial fields exactly as
+run_redgreen_experiment.parse_json returns them (geometry, sensors, fps,
+timestep, radius, rg_outcome, world size) and the slice of the trajectory
+arrays holding its ball path. It also records the parsed repeat.csv counts,
+the validation results (scene_dims of every trial and which are not square,
+the check SYMMETRY_TRANSFORM_TO_REDUCE_CARRYOVER_EFFECTS relies on) and the
+fingerprint of the source files.
+
+At startup, run_redgreen_experiment.py memory-maps a bundle whose fingerprint
+matches the dataset folder, so trajectories are zero-copy views shared by all
+gunicorn workers through the page cache and no JSON is parsed. A missing or
+stale bundle (the contents of any simulation_data.json or repeat.csv changed
+since it was built) is ignored with a warning and the server reads the JSON
+files as before. The fingerprint ignores the folder's location and file
+mtimes, so a bundle stays valid when copied to another machine or checkout.
+Dataset errors (unreadable JSON, repeat.csv naming unknown trials) make the
+build fail instead of surfacing under live traffic.
+
+The module only needs NumPy and redgreen_trajectories, so bundles can be built
+without the server's Flask and database stack installed.
+
+Usage:
+    python compile_redgreen_dataset.py trial_data/ecog_stimuli_v6
+    python compile_redgreen_dataset.py trial_data/ecog_stimuli_v6 --check   # validate an existing bundle
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+from redgreen_trajectories import Trajectory, trajectory_from_step_data
+
+BUNDLE_MAGIC = b"RGBNDL01"
+BUNDLE_FORMAT_VERSION = 1
+BUNDLE_SUFFIX = ".bundle"
+_HEADER = struct.Struct("<8sQ")
+
+
+class DatasetCompileError(Exception):
+    """Raised when a dataset folder cannot be compiled; the message lists every problem found."""
+
+
+# Per-process cache: file path -> ((mtime_ns, size), sha1 of its contents), so
+# unchanged files are only stat()ed on repeat calls.
+_FILE_DIGEST_CACHE = {}
+
+
+def _file_digest(path, st):
+    stat_key = (st.st_mtime_ns, st.st_size)
+    cached = _FILE_DIGEST_CACHE.get(path)
+    if cached is not None and cached[0] == stat_key:
+        return cached[1]
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    _FILE_DIGEST_CACHE[path] = (stat_key, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def dataset_fingerprint(absolute_directory_path):
+    """
+    Content hash of a dataset folder built from the relative name and the
+    contents of every trial's simulation_data.json and of repeat.csv. Neither
+    the folder's location nor file mtimes enter the hash, so a bundle compiled
+    on another machine or in a fresh checkout still matches identical files.
+    File contents are only re-read when their mtime or size changes, so repeat
+    calls (every session start) cost one stat() per trial.
+    """
+    digest = hashlib.sha1()
+    try:
+        entries = sorted(os.listdir(absolute_directory_path))
+    except (FileNotFoundError, PermissionError):
+        return None
+    for entry in entries:
+        if entry == "repeat.csv":
+            path = os.path.join(absolute_directory_path, entry)
+        else:
+            path = os.path.join(absolute_directory_path, entry, 'simulation_data.json')
+        try:
+            file_digest = _file_digest(path, os.stat(path))
+        except OSError:
+            continue
+        digest.update(f"{entry}:{file_digest};".encode())
+    return digest.hexdigest()
+
+
+def bundle_path_for_dataset(absolute_directory_path):
+    """Path of the compiled bundle for a dataset folder (a sibling file, not inside the folder)."""
+    return os.path.normpath(absolute_directory_path) + BUNDLE_SUFFIX
+
+
+def parse_trial_data(data):
+    """
+    Convert a loaded simulation_data.json into the trial dict used by the server.
+
+    JSON files contain:
+    - barriers: Physical obstacles in the scene
+    - occluders: Visual occlusion elements
+    - step_data: Frame-by-frame position data for moving objects
+    - red_sensor/green_sensor: Sensor position and properties
+    - timestep: Animation frame duration
+    - target: Information about the target object
+    - rg_outcome: Ground truth answer ('red' or 'green')
+    """
+    # Extract world dimensions from scene_dims
+    scene_dims = data.get("scene_dims", [20, 20])
+    world_width = scene_dims[0] if len(scene_dims) > 0 else 20
+    world_height = scene_dims[1] if len(scene_dims) > 1 else 20
+
+    return {
+        # Convert barrier/occluder data to list of dicts with rounded coordinates
+        "barriers": [{key: round(value, 2) if isinstance(value, (int, float)) else value
+                     for key, value in item.items()}
+                    for item in data.get("barriers", [])],
+        "occluders": [{key: round(value, 2) if isinstance(value, (int, float)) else value
+                      for key, value in item.items()}
+                     for item in data.get("occluders", [])],
+        # Ball trajectory as contiguous frame/x/y arrays (see redgreen_trajectories.py);
+        # encoded back to the frame-indexed dict (or a compact format) for the frontend
+        "step_data": trajectory_from_step_data(data.get("step_data", {})),
+        # Sensor configuration data
+        "red_sensor": data.get("red_sensor", {}),
+        "green_sensor": data.get("green_sensor", {}),
+        # Animation timing
+        "timestep": round(data.get("timestep", 0), 2),
+        "fps": int(data.get("fps", 30)),  # FPS from simulation JSON
+        # Target object radius (from size)
+        "radius": data.get('target', {}).get('size', 0) / 2,
+        # Ground truth outcome for scoring
+        "rg_outcome": data.get("rg_outcome", ""),
+        # World dimensions
+        "worldWidth": world_width,
+        "worldHeight": world_height,
+    }
+
+
+def read_repeat_counts(repeat_csv_path):
+    """
+    Parse repeat.csv (one 'trial_name,extra_repetitions' row per line, '#' comments allowed)
+    into {trial_name: total extra repetitions}. Malformed rows are skipped.
+    """
+    repeat_counts = {}
+    with open(repeat_csv_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = [p.strip() for p in line.split(",")]
+            if len(parts) != 2:
+                continue
+            trial_name, extra_str = parts
+            try:
+                extra = int(extra_str)
+            except ValueError:
+                continue
+            if extra > 0:
+                repeat_counts[trial_name] = repeat_counts.get(trial_name, 0) + extra
+    return repeat_counts
+
+
+def _padding(offset, alignment=8):
+    return b"\0" * (-offset % alignment)
+
+
+def compile_dataset(dataset_dir, output_path=None):
+    """
+    Compile a dataset folder into a binary bundle.
+
+    Args:
+        dataset_dir: Dataset folder containing <trial>/simulation_data.json files
+        output_path: Bundle to write (default: bundle_path_for_dataset(dataset_dir))
+
+    Returns:
+        dict: the bundle index that was written
+
+    Raises:
+        DatasetCompileError: if any trial cannot be read or repeat.csv names unknown trials
+    """
+    start = time.perf_counter()
+    absolute_directory_path = os.path.abspath(dataset_dir)
+    output_path = output_path or bundle_path_for_dataset(absolute_directory_path)
+    # Taken before reading any file, so edits made during the build mark the bundle stale
+    fingerprint = dataset_fingerprint(absolute_directory_path)
+    if fingerprint is None:
+        raise DatasetCompileError(f"Dataset folder '{absolute_directory_path}' does not exist or is not readable")
+
+    errors = []
+    trials = {}
+    trajectories = []
+    num_frames_total = 0
+    for entry in sorted(os.listdir(absolute_directory_path)):
+        json_path = os.path.join(absolute_directory_path, entry, "simulation_data.json")
+        if not os.path.isfile(json_path):
+            continue
+        try:
+            with open(json_path, "r") as f:
+                trial_data = parse_trial_data(json.load(f))
+        except Exception as e:
+            errors.append(f"{entry}: cannot parse simulation_data.json ({type(e).__name__}: {e})")
+            continue
+        trajectory = trial_data.pop("step_data")
+        trials[entry] = {
+            "fields": trial_data,
+            "frame_offset": num_frames_total,
+            "num_frames": len(trajectory.frames),
+        }
+        trajectories.append(trajectory)
+        num_frames_total += len(trajectory.frames)
+
+    repeat_counts = {}
+    repeat_csv_path = os.path.join(absolute_directory_path, "repeat.csv")
+    if os.path.exists(repeat_csv_path):
+        try:
+            repeat_counts = read_repeat_counts(repeat_csv_path)
+        except Exception as e:
+            errors.append(f"repeat.csv: cannot be read ({type(e).__name__}: {e})")
+        for trial_name in sorted(set(repeat_counts) - set(trials)):
+            errors.append(f"repeat.csv: trial '{trial_name}' has no simulation_data.json in this dataset")
+
+    if errors:
+        raise DatasetCompileError(
+            f"{len(errors)} problem(s) in dataset '{absolute_directory_path}':\n  " + "\n  ".join(errors)
+        )
+
+    scene_dims = {name: [trial["fields"]["worldWidth"], trial["fields"]["worldHeight"]] for name, trial in trials.items()}
+    index = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "source_directory": absolute_directory_path,
+        "source_fingerprint": fingerprint,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "num_frames": num_frames_total,
+        "trials": trials,
+        "repeat_counts": repeat_counts,
+        "validation": {
+            "scene_dims": scene_dims,
+            "non_square_trials": sorted(name for name, (w, h) in scene_dims.items() if not (w == h and w > 0)),
+        },
+    }
+
+    index_bytes = json.dumps(index, separators=(",", ":")).encode()
+    frames = np.concatenate([t.frames for t in trajectories] or [np.empty(0)]).astype("<i4")
+    x = np.concatenate([t.x for t in trajectories] or [np.empty(0)]).astype("<f8")
+    y = np.concatenate([t.y for t in trajectories] or [np.empty(0)]).astype("<f8")
+
+    # Write-then-rename so running servers never map a half-written bundle
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(BUNDLE_MAGIC, len(index_bytes)))
+        f.write(index_bytes)
+        f.write(_padding(f.tell()))
+        f.write(frames.tobytes())
+        f.write(_padding(f.tell()))
+        f.write(x.tobytes())
+        f.write(y.tobytes())
+    os.replace(tmp_path, output_path)
+
+    elapsed = time.perf_counter() - start
+    print(f"Compiled {len(trials)} trials ({num_frames_total} frames) from '{absolute_directory_path}' "
+          f"into '{output_path}' ({os.path.getsize(output_path)} bytes) in {elapsed:.2f}s.")
+    if index["validation"]["non_square_trials"]:
+        print(f"Warning: non-square scenes (symmetry transforms cannot be used): "
+              f"{', '.join(index['validation']['non_square_trials'])}")
+    return index
+
+
+def load_dataset_bundle(bundle_path):
+    """
+    Memory-map a compiled bundle.
+
+    Returns:
+        dict with the bundle 'index' and 'trials', which maps each trial folder name
+        to a trial dict as parse_trial_data returns it; its step_data Trajectory
+        arrays are read-only views into the mapped file
+    """
+    with open(bundle_path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, index_length = _HEADER.unpack_from(buffer, 0)
+    if magic != BUNDLE_MAGIC:
+        raise ValueError(f"'{bundle_path}' is not a Red-Green dataset bundle")
+    index = json.loads(buffer[_HEADER.size:_HEADER.size + index_length])
+    if index.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"'{bundle_path}' has unsupported format version {index.get('format_version')}")
+
+    num_frames = index["num_frames"]
+    frames_offset = _HEADER.size + index_length
+    frames_offset += -frames_offset % 8
+    x_offset = frames_offset + 4 * num_frames
+    x_offset += -x_offset % 8
+    y_offset = x_offset + 8 * num_frames
+    frames = np.frombuffer(buffer, dtype="<i4", count=num_frames, offset=frames_offset)
+    x = np.frombuffer(buffer, dtype="<f8", count=num_frames, offset=x_offset)
+    y = np.frombuffer(buffer, dtype="<f8", count=num_frames, offset=y_offset)
+
+    trials = {}
+    for name, trial in index["trials"].items():
+        window = slice(trial["frame_offset"], trial["frame_offset"] + trial["num_frames"])
+        trial_data = dict(trial["fields"])
+        trial_data["step_data"] = Trajectory(frames=frames[window], x=x[window], y=y[window])
+        trials[name] = trial_data
+    return {"index": index, "trials": trials}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a Red-Green trial dataset folder into a binary bundle.")
+    parser.add_argument("dataset", help="Dataset folder, e.g. trial_data/ecog_stimuli_v6")
+    parser.add_argument("--output", default=None, help="Bundle path (default: <dataset folder>.bundle)")
+    parser.add_argument("--check", action="store_true",
+                        help="Only check that the existing bundle is readable and up to date with the folder")
+    args = parser.parse_args()
+
+    if args.check:
+        absolute_directory_path = os.path.abspath(args.dataset)
+        bundle_path = args.output or bundle_path_for_dataset(absolute_directory_path)
+        bundle = load_dataset_bundle(bundle_path)
+        up_to_date = bundle["index"]["source_fingerprint"] == dataset_fingerprint(absolute_directory_path)
+        print(f"'{bundle_path}': {len(bundle['trials'])} trials, {bundle['index']['num_frames']} frames, "
+              f"built {bundle['index']['built_at']}, {'up to date' if up_to_date else 'STALE (rebuild it)'}.")
+        raise SystemExit(0 if up_to_date else 1)
+
+    try:
+        compile_dataset(args.dataset, args.output)
+    except DatasetCompileError as e:
+        raise SystemExit(f"Error: {e}")
@@ -1,22 +1,135 @@
+import threading
+import time
 import dash
-from dash import dcc, html, dash_table
+from dash import dcc, html, dash_table, ctx
 from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
 import requests
 import pandas as pd
 import plotly.graph_objs as go
 import dash_bootstrap_components as dbc
 
+API_BASE_URL = "http://127.0.0.1:5000"
+FALLBACK_POLL_SECONDS = 30  # Poll interval used only while the live event stream is disconnected
+MIN_SYNC_SECONDS = 10  # Live events arriving within this long of a sync are merged into the next one
+
+# Local incremental cache of session summaries, keyed by session id, kept in sync
+# through the backend's /sessions/changes feed so each poll only transfers deltas.
+# Shared by every browser viewing this dashboard.
+_session_cache = {}
+_change_cursor = None
+_cache_lock = threading.Lock()
+_last_sync_time = 0.0
+
+# Per-frame time series of the sessions being plotted, keyed by session id. They are
+# only refetched when the session's num_keystate_frames no longer matches, and then
+# only the frames past the cached length are requested from /sessions/<id>/time_series.
+_time_series_cache = {}
+_time_series_lock = threading.Lock()
+
+# Set by the live event listener whenever the backend reports progress
+_cache_dirty = threading.Event()
+_cache_dirty.set()
+_stream_connected = threading.Event()
+
 # Fetch data from the Flask API
 def fetch_sessions():
+    """Merge changes since the last poll into the local cache and return all cached sessions."""
+    global _last_sync_time
+    with _cache_lock:
+        _cache_dirty.clear()
+        _last_sync_time = time.monotonic()
+        _sync_session_cache()
+        return [_session_cache[session_id] for session_id in sorted(_session_cache)]
+
+def _sync_session_cache():
+    global _change_cursor
     try:
-        response = requests.get("http://127.0.0.1:5000/sessions")
+        params = {}
+        if _change_cursor:
+            params["cursor"] = _change_cursor
+        response = requests.get(f"{API_BASE_URL}/sessions/changes", params=params)
         if response.status_code == 200:
-            return response.json()
+            changes = response.json()
+            if changes["full"]:
+                _session_cache.clear()
+            for session in changes["sessions"]:
+                _session_cache[session["id"]] = session
+            _change_cursor = changes["cursor"]
         else:
-            return []
+            print(f"Error fetching session changes: HTTP {response.status_code}")
     except Exception as e:
         print(f"Error fetching sessions: {e}")
-        return []
+        _cache_dirty.set()  # Retry on the next tick
+
+def fetch_time_series(session):
+    """Per-frame red/green/uncertain series of a cached session, fetching only frames not seen before."""
+    with _time_series_lock:
+        series = _time_series_cache.get(session["id"])
+        if series is not None and len(series["red"]) == session["num_keystate_frames"]:
+            return series  # Nothing new since the last fetch
+        try:
+            new_frames = _get_time_series(session["id"], len(series["red"]) if series is not None else 0)
+            if series is not None and new_frames["num_frames"] < len(series["red"]):
+                series, new_frames = None, _get_time_series(session["id"], 0)  # Stored series changed; start over
+        except Exception as e:
+            print(f"Error fetching time series of session {session['id']}: {e}")
+            return series or {"red": [], "green": [], "uncertain": []}
+        series = series or {"red": [], "green": [], "uncertain": []}
+        for key in ("red", "green", "uncertain"):
+            series[key].extend(new_frames[key])
+        _time_series_cache[session["id"]] = series
+        return series
+
+def _get_time_series(session_id, offset):
+    response = requests.get(f"{API_BASE_URL}/sessions/{session_id}/time_series", params={"offset": offset})
+    response.raise_for_status()
+    return response.json()
+
+def cached_sessions():
+    """Return the locally cached sessions without contacting the backend."""
+    with _cache_lock:
+        return [_session_cache[session_id] for session_id in sorted(_session_cache)]
+
+def needs_sync():
+    """
+    True if live events arrived since the last sync and MIN_SYNC_SECONDS have passed
+    (a burst of events costs one backend call), or the stream is down and the
+    fallback poll is due.
+    """
+    since_last_sync = time.monotonic() - _last_sync_time
+    if _cache_dirty.is_set():
+        return since_last_sync >= MIN_SYNC_SECONDS
+    return not _stream_connected.is_set() and since_last_sync >= FALLBACK_POLL_SECONDS
+
+def listen_for_events():
+    """
+    Consume the backend's /events/stream and mark the cache dirty on every event.
+    
+    Runs in a background thread for the lifetime of the dashboard. One stream is
+    shared by all viewers, so the backend sees a single subscriber no matter how
+    many researchers have the dashboard open. Reconnects with Last-Event-ID so
+    no events are missed across stream restarts.
+    """
+    last_event_id = None
+    retry_seconds = 2.0
+    while True:
+        try:
+            headers = {"Last-Event-ID": str(last_event_id)} if last_event_id is not None else {}
+            with requests.get(f"{API_BASE_URL}/events/stream", headers=headers, stream=True, timeout=(5, 60)) as response:
+                response.raise_for_status()
+                _stream_connected.set()
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("id:"):
+                        last_event_id = int(line[3:].strip())
+                    elif line.startswith("retry:"):
+                        retry_seconds = int(line[6:].strip()) / 1000
+                    elif line.startswith("data:"):
+                        _cache_dirty.set()
+        except Exception as e:
+            print(f"Live event stream disconnected: {e}")
+        _stream_connected.clear()
+        time.sleep(retry_seconds)
 
 # Initialize Dash App
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
@@ -24,6 +137,7 @@ server = app.server
 
 # Initial Data
 sessions_data = fetch_sessions()
+threading.Thread(target=listen_for_events, name="live-event-listener", daemon=True).start()
 
 # Prepare Sessions DataFrame
 def prepare_sessions_dataframe(sessions):
@@ -40,7 +154,7 @@ app.layout = html.Div(
         html.H1("REDGREEN Experiment Dashboard", style={"textAlign": "center"}),
         dcc.Interval(
             id="interval-component",
-            interval=30 * 1000,  # Refresh every 30 seconds (in milliseconds)
+            interval=2 * 1000,  # Check for live updates every 2 seconds (in milliseconds); no backend call unless something changed
             n_intervals=0,
         ),
         html.Div(
@@ -109,8 +223,16 @@ app.layout = html.Div(
     [Input("interval-component", "n_intervals"), Input("participant-dropdown", "value"), Input("trial-distribution-dropdown", "value")],
 )
 def update_dashboard(n_intervals, selected_participant, selected_distribution):
-    # Fetch updated data
-    sessions = fetch_sessions()
+    # Timer ticks only contact the backend when live events arrived (or the stream is down);
+    # otherwise nothing changed and the page is left as is. Other triggers re-render from the local cache.
+    if ctx.triggered_id == "interval-component":
+        if not needs_sync():
+            raise PreventUpdate
+        sessions = fetch_sessions()
+    elif not _session_cache:
+        sessions = fetch_sessions()
+    else:
+        sessions = cached_sessions()
 
     # Prepare DataFrame for Session Table
     sessions_df = prepare_sessions_dataframe(sessions)
@@ -145,7 +267,7 @@ def update_dashboard(n_intervals, selected_participant, selected_distribution):
     }
     if selected_distribution:
         if selected_distribution == "aggregate":
-            all_time_series = [session["time_series_data"] for session in sessions]
+            all_time_series = [fetch_time_series(session) for session in sessions]
             aggregate_time_series = {
                 "red": pd.DataFrame([ts["red"] for ts in all_time_series]).mean(axis=0),
                 "green": pd.DataFrame([ts["green"] for ts in all_time_series]).mean(axis=0),
@@ -162,8 +284,8 @@ def update_dashboard(n_intervals, selected_participant, selected_distribution):
             }
         else:
             participant_data = next((s for s in sessions if s["prolific_pid"] == selected_distribution), None)
-            if participant_data and "time_series_data" in participant_data:
-                time_series_data = participant_data["time_series_data"]
+            if participant_data:
+                time_series_data = fetch_time_series(participant_data)
                 frames = range(len(time_series_data["red"]))
                 button_distribution_figure = {
                     "data": [
@@ -0,0 +1,315 @@
+"""
+Streaming, incremental export of the Red-Green database to a combined CSV.
+
+Produces the same flattened dataset as the original in-server export (one row
+per frame of keypress data for experimental trials, with session metadata,
+trial index/score and binary red/green/uncertain response indicators), but:
+
+- rows come from one joined, ordered SQL query per keystate table, read in
+  chunks, so memory stays bounded regardless of database size;
+- each run only appends frames stored since the previous run. The export
+  watermark (highest exported keystate / keystate_run id, the CSV size at
+  that point and a digest of every exported trial's metadata) is kept next to
+  the CSV in <output>.watermark.json;
+- session columns that keep changing after a participant's frames were
+  exported (completed, has_timed_out, ignore_data, average_score, time_taken,
+  end_time) are not repeated on every frame. They go to a small side file,
+  <output stem>_sessions.csv, rewritten on every run; join it on session_id;
+- it has no Flask dependency and is meant to run as its own process
+  (run_redgreen_experiment.schedule_csv_exports launches it with
+  subprocess), so exporting never competes with request workers for the GIL.
+
+The per-frame columns (Prolific ids, session start time, trial index and
+score) are fixed once a trial's keystates are stored, so appending is safe.
+If one of them does change for an exported trial (e.g. after rescoring or
+deleting trials), or keystate rows up to the watermark were deleted or
+committed late with a lower id (possible on PostgreSQL), the run rebuilds the
+CSV from scratch into a temporary file and renames it into place.
+
+A crash between appending rows and updating the watermark is harmless: the
+next run truncates the CSV back to the size recorded in the watermark before
+appending again.
+
+Usage:
+    python export_redgreen_data.py --db path/to/redgreen.db --output redgreen_combined.csv
+    REDGREEN_DATABASE_URL=postgresql+psycopg2://... python export_redgreen_data.py --output redgreen_combined.csv
+
+Without --db the database is taken from REDGREEN_DATABASE_URL, which keeps
+credentials in a URL off the command line (and out of `ps`).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+
+EXPORT_COLUMNS = [
+    "session_id", "start_time", "prolific_pid", "study_id", "prolific_session_id",
+    "trial_index", "score", "red", "green", "uncertain", "frame",
+]
+
+# Columns of the sessions side file, in order (older databases may lack some)
+SESSION_COLUMNS = [
+    "session_id", "completed", "has_timed_out", "ignore_data", "average_score", "time_taken", "end_time",
+]
+
+DEFAULT_CHUNK_SIZE = 50000
+WATERMARK_VERSION = 3
+
+# Per-trial columns copied onto every exported frame; a change to any of them
+# for an already exported trial forces a rebuild
+_TRIAL_COLUMNS = ["session_id", "start_time", "prolific_pid", "study_id", "prolific_session_id", "trial_index", "score"]
+_NUMERIC_TRIAL_COLUMNS = ["session_id", "trial_index", "score"]
+
+_SESSION_TRIAL_COLUMNS = """
+    t.id AS trial_id, s.id AS session_id, s.start_time, s.prolific_pid, s.study_id,
+    s.prolific_session_id, t.trial_index, t.score
+"""
+
+_TRIAL_QUERY = f"""
+    SELECT {_SESSION_TRIAL_COLUMNS}
+    FROM trial t
+    JOIN redgreen_session s ON s.id = t.session_id
+    WHERE t.trial_type = 'trial'
+"""
+
+# Per-frame keystate rows (KEYSTATE_STORAGE_MODE = 'rows')
+_KEYSTATE_QUERY = f"""
+    SELECT ks.id AS source_id, {_SESSION_TRIAL_COLUMNS},
+           ks.frame, ks.f_pressed, ks.j_pressed
+    FROM keystate ks
+    JOIN trial t ON t.id = ks.trial_id
+    JOIN redgreen_session s ON s.id = t.session_id
+    WHERE t.trial_type = 'trial' AND ks.id > :after AND ks.id <= :upto
+    ORDER BY ks.id
+"""
+
+# Run-length encoded keystates (KEYSTATE_STORAGE_MODE = 'rle'), expanded per frame after reading
+_KEYSTATE_RUN_QUERY = f"""
+    SELECT ksr.id AS source_id, {_SESSION_TRIAL_COLUMNS},
+           ksr.start_frame, ksr.end_frame, ksr.f_pressed, ksr.j_pressed
+    FROM keystate_run ksr
+    JOIN trial t ON t.id = ksr.trial_id
+    JOIN redgreen_session s ON s.id = t.session_id
+    WHERE t.trial_type = 'trial' AND ksr.id > :after AND ksr.id <= :upto
+    ORDER BY ksr.id
+"""
+
+# (table, rows query, is run-length encoded)
+_SOURCES = [
+    ("keystate", _KEYSTATE_QUERY, False),
+    ("keystate_run", _KEYSTATE_RUN_QUERY, True),
+]
+
+
+def _watermark_path(output_path):
+    return output_path + ".watermark.json"
+
+
+def sessions_path(output_path):
+    """Path of the sessions side file written next to output_path (redgreen_combined.csv -> redgreen_combined_sessions.csv)."""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}_sessions{ext or '.csv'}"
+
+
+def load_watermark(output_path):
+    """Return the saved export watermark for output_path, or None if there is none (or it is from an older version)."""
+    try:
+        with open(_watermark_path(output_path)) as f:
+            watermark = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return watermark if watermark.get("version") == WATERMARK_VERSION else None
+
+
+def _save_watermark(output_path, watermark):
+    # Write-then-rename so a crash never leaves a half-written watermark
+    tmp_path = _watermark_path(output_path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(watermark, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _watermark_path(output_path))
+
+
+def _trial_digests(rows):
+    """
+    {trial id (str): digest of its per-frame columns} for the trials in rows.
+    Numbers are compared as floats and missing values alike, so digests taken
+    from keystate chunks and from the trial query agree.
+    """
+    trials = rows.drop_duplicates("trial_id")
+    rendered = trials[_TRIAL_COLUMNS].astype(object)
+    for column in _NUMERIC_TRIAL_COLUMNS:
+        rendered[column] = pd.to_numeric(trials[column], errors="coerce").astype(float)
+    rendered = rendered.astype(str).where(trials[_TRIAL_COLUMNS].notna().to_numpy(), "")
+    keys = trials["trial_id"].astype(np.int64).astype(str)
+    values = rendered.agg("\x1f".join, axis=1)
+    return {key: hashlib.sha1(value.encode()).hexdigest()[:16] for key, value in zip(keys, values)}
+
+
+def _expand_runs(chunk):
+    """Expand keystate_run rows into one row per frame (start_frame..end_frame inclusive)."""
+    lengths = (chunk["end_frame"] - chunk["start_frame"] + 1).to_numpy()
+    expanded = chunk.loc[chunk.index.repeat(lengths)].reset_index(drop=True)
+    run_starts_in_output = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    expanded["frame"] = expanded["start_frame"].to_numpy() + (np.arange(lengths.sum()) - run_starts_in_output)
+    return expanded
+
+
+def _to_export_rows(chunk):
+    """Convert joined keystate rows to the combined CSV columns."""
+    f_pressed = chunk["f_pressed"].fillna(False).astype(bool)
+    j_pressed = chunk["j_pressed"].fillna(False).astype(bool)
+    red = (f_pressed & ~j_pressed).astype(int)
+    green = (j_pressed & ~f_pressed).astype(int)
+    return pd.DataFrame({
+        "session_id": chunk["session_id"],
+        "start_time": pd.to_datetime(chunk["start_time"]),
+        "prolific_pid": chunk["prolific_pid"],
+        "study_id": chunk["study_id"],
+        "prolific_session_id": chunk["prolific_session_id"],
+        "trial_index": chunk["trial_index"],
+        "score": chunk["score"],
+        "red": red,
+        "green": green,
+        "uncertain": 1 - (red | green),
+        "frame": chunk["frame"],
+    }, columns=EXPORT_COLUMNS)
+
+
+def _count_rows(conn, query, upto):
+    """Number of rows the (unexpanded) rows query returns for ids up to upto."""
+    return conn.execute(text(f"SELECT COUNT(*) FROM ({query}) AS rows_upto"), {"after": 0, "upto": upto}).scalar()
+
+
+def _rebuild_reason(conn, watermark, existing_tables):
+    """Why the exported rows no longer match the database (None if appending is safe)."""
+    for table_name, query, _ in _SOURCES:
+        state = watermark["tables"].get(table_name)
+        if state is None:
+            continue
+        if table_name not in existing_tables or _count_rows(conn, query, state["max_id"]) != state["rows"]:
+            return f"{table_name} rows were deleted or committed out of id order"
+    if watermark["trials"]:
+        current = _trial_digests(pd.read_sql(text(_TRIAL_QUERY), conn))
+        if any(current.get(trial_id) != digest for trial_id, digest in watermark["trials"].items()):
+            return "trials were changed or deleted after their frames were exported"
+    return None
+
+
+def _append_frames(conn, out, watermark, existing_tables, chunk_size):
+    """Append the frames of keystate rows stored since the watermark to out; returns the number of frames."""
+    appended_rows = 0
+    for table_name, query, is_run_length in _SOURCES:
+        if table_name not in existing_tables:
+            continue
+        state = watermark["tables"].setdefault(table_name, {"max_id": 0, "rows": 0})
+        max_id = conn.execute(text(f"SELECT MAX(id) FROM {table_name}")).scalar() or 0
+        result = conn.execution_options(stream_results=True).execute(
+            text(query), {"after": state["max_id"], "upto": max_id}
+        )
+        columns = list(result.keys())
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunk = pd.DataFrame(rows, columns=columns)
+            state["rows"] += len(chunk)
+            watermark["trials"].update(_trial_digests(chunk))
+            if is_run_length:
+                chunk = _expand_runs(chunk)
+            export_rows = _to_export_rows(chunk)
+            export_rows.to_csv(out, index=False, header=False)
+            appended_rows += len(export_rows)
+        state["max_id"] = max(state["max_id"], max_id)
+    return appended_rows
+
+
+def _write_sessions(conn, output_path):
+    """Rewrite the sessions side file with the current session columns; returns the number of sessions."""
+    available = {column["name"] for column in inspect(conn).get_columns("redgreen_session")}
+    columns = ["id AS session_id"] + [column for column in SESSION_COLUMNS[1:] if column in available]
+    sessions = pd.read_sql(text(f"SELECT {', '.join(columns)} FROM redgreen_session ORDER BY id"), conn)
+    path = sessions_path(output_path)
+    sessions.to_csv(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    return len(sessions)
+
+
+def export_combined_csv(db_url, output_path="redgreen_combined.csv", chunk_size=DEFAULT_CHUNK_SIZE, full=False):
+    """
+    Append keystate frames stored since the last export to output_path and
+    rewrite its sessions side file (see sessions_path).
+
+    Args:
+        db_url: SQLAlchemy database URL (e.g. 'sqlite:////abs/path/redgreen.db')
+        output_path: Combined CSV to create or append to
+        chunk_size: Number of database rows fetched and written per chunk
+        full: Ignore any existing watermark and rewrite the CSV from scratch
+
+    Returns:
+        dict with the number of appended rows, whether the CSV was rebuilt and the new watermark
+    """
+    start = time.perf_counter()
+    watermark = None if full else load_watermark(output_path)
+    if watermark is not None and not os.path.exists(output_path):
+        watermark = None
+
+    engine = create_engine(db_url)
+    existing_tables = set(inspect(engine).get_table_names())
+    try:
+        with engine.connect() as conn:
+            reason = None if watermark is None else _rebuild_reason(conn, watermark, existing_tables)
+            rebuilt = watermark is None or reason is not None
+            if reason is not None:
+                print(f"Export: {reason}; rebuilding '{output_path}'.")
+            if rebuilt:
+                # Write a fresh file next to the old one and swap it in once complete
+                watermark = {"version": WATERMARK_VERSION, "bytes": 0, "tables": {}, "trials": {}}
+                csv_path = output_path + ".tmp"
+                with open(csv_path, "w", newline="") as out:
+                    pd.DataFrame(columns=EXPORT_COLUMNS).to_csv(out, index=False)
+            else:
+                csv_path = output_path
+                # Drop anything appended after the last recorded watermark (interrupted run)
+                with open(csv_path, "r+b") as f:
+                    f.truncate(watermark["bytes"])
+
+            with open(csv_path, "a", newline="") as out:
+                appended_rows = _append_frames(conn, out, watermark, existing_tables, chunk_size)
+                out.flush()
+                os.fsync(out.fileno())
+                watermark["bytes"] = out.tell()
+            if rebuilt:
+                os.replace(csv_path, output_path)
+            num_sessions = _write_sessions(conn, output_path)
+    finally:
+        engine.dispose()
+    _save_watermark(output_path, watermark)
+
+    elapsed = time.perf_counter() - start
+    action = "Wrote" if rebuilt else "Appended"
+    print(f"{action} {appended_rows} rows to '{output_path}' and {num_sessions} sessions to "
+          f"'{sessions_path(output_path)}' in {elapsed:.2f}s.")
+    return {"appended_rows": appended_rows, "rebuilt": rebuilt, "watermark": watermark}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally export Red-Green keystate data to a combined CSV.")
+    parser.add_argument("--db", default=os.environ.get("REDGREEN_DATABASE_URL"),
+                        help="Path to the SQLite database file, or a SQLAlchemy URL (default: $REDGREEN_DATABASE_URL)")
+    parser.add_argument("--output", default="redgreen_combined.csv", help="Combined CSV to create or append to")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows fetched per chunk")
+    parser.add_argument("--full", action="store_true", help="Rewrite the CSV from scratch instead of appending")
+    args = parser.parse_args()
+    if not args.db:
+        parser.error("--db is required when REDGREEN_DATABASE_URL is not set")
+
+    db_url = args.db if "://" in args.db else "sqlite:///" + os.path.abspath(args.db).replace("\\", "/")
+    export_combined_csv(db_url, args.output, chunk_size=args.chunk_size, full=args.full)
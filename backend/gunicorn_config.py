@@ -14,11 +14,31 @@ SERVER SOCKET:
 WORKER PROCESSES:
 - workers = multiprocessing.cpu_count() * 2 + 1: Creates multiple worker processes
   Formula: (CPU cores × 2) + 1 - balances CPU and I/O bound operations
-- worker_class = "sync": Uses synchronous workers (simpler, good for most Flask apps)
+- worker_class = "gthread": Threaded workers; a long-lived /events/stream connection
+  (server-sent events for the dashboard) occupies one thread instead of a whole worker,
+  and the worker keeps heart-beating so it is not killed by the timeout
+- threads = 4: Request-handling threads per worker. Up to 4 requests run at once in the
+  same process, so request code must be thread-safe. Each thread gets its own
+  Flask-SQLAlchemy session and pooled connection (DB_POOL_SIZE matches threads).
+  Profile IDs are claimed atomically in the database. Process-wide state is either built
+  under a lock and read-only afterwards (_DATASET_CACHE and the symmetry mapping, under
+  _DATASET_CACHE_LOCK), or guarded by its owner's lock (KeyStateDrainer,
+  ExperimentEventBroadcaster). New module-level mutable state needs a lock too.
+  threads = 1 restores one request at a time per worker, but then every open
+  /events/stream holds a whole worker
 - worker_connections = 1000: Max simultaneous connections per worker
 - timeout = 30: Workers restart if they don't respond within 30 seconds
 - keepalive = 2: Keep connections alive for 2 seconds to reuse them
 
+PRELOADING:
+- preload_app = True: The master imports the app once: database schema setup and
+  migrations, the startup session report and dataset loading run a single time, and
+  workers are forked with the loaded trial data already in memory (shared
+  copy-on-write instead of one copy per worker). Set REDGREEN_PRELOAD_APP=0 to let
+  every worker import the app itself (needed for --reload during development)
+- when_ready / post_fork: Close the master's database connections and freeze the
+  preloaded objects before forking; each worker then starts its own connection pool
+
 LOGGING:
 - accesslog/errorlog = "-": Log to stdout/stderr (visible in terminal)
 - loglevel = "info": Show info-level messages and above
@@ -43,11 +63,28 @@ backlog = 2048
 # Worker processes
 workers = multiprocessing.cpu_count() * 2 + 1  # Recommended formula
 print(f"Number of workers: {workers}")
-worker_class = "sync"
+worker_class = "gthread"
+threads = 4
 worker_connections = 1000
 timeout = 30
 keepalive = 2
 
+# Preloading
+preload_app = os.environ.get("REDGREEN_PRELOAD_APP", "1") != "0"
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded, before the first worker is forked
+    if preload_app:
+        import run_redgreen_experiment
+        run_redgreen_experiment.prepare_for_worker_fork()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import run_redgreen_experiment
+        run_redgreen_experiment.reinitialize_after_fork()
+
 # Logging
 accesslog = "-"  # Log to stdout
 errorlog = "-"   # Log to stderr
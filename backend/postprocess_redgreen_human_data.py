@@ -2,9 +2,13 @@
 # the code here is primarily used for the analysis of the HUMAN empirical data
 
 import os
+import hashlib
+import shutil
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import matplotlib.pyplot as plt
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 import json
 import cv2
 from tqdm import tqdm
@@ -14,6 +18,10 @@ import numpy as np
 from matplotlib.gridspec import GridSpec
 from matplotlib.patches import Rectangle
 
+from redgreen_scoring import OUTCOME_SIGNS, score_trials, cumulative_scores, frame_durations_ms
+from redgreen_occlusion import FULLY_VISIBLE_FRACTION, dataset_occlusion, occluded_runs
+from compile_redgreen_dataset import dataset_fingerprint
+
 
 def _load_allowed_repeat_trial_names(path_to_data):
     """
@@ -45,8 +53,104 @@ def _load_allowed_repeat_trial_names(path_to_data):
     return allowed
 
 
+# Keystate rows are read this many at a time and converted to KEYSTATE_DTYPES as they
+# arrive, so peak memory stays close to the size of the final, compact DataFrame
+KEYSTATE_READ_CHUNK_SIZE = 200000
+KEYSTATE_DTYPES = {'frame': np.int32, 'f_pressed': np.int8, 'j_pressed': np.int8, 'trial_id': np.int64}
+
+
+def _stage_ids(conn, table_name, ids):
+    """
+    Load ids into a temporary table (id INTEGER PRIMARY KEY) on conn, replacing any
+    earlier contents, so queries can join against it instead of inlining every id
+    into an IN (...) list. Returns table_name.
+    """
+    conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+    conn.execute(text(f"CREATE TEMPORARY TABLE {table_name} (id INTEGER PRIMARY KEY)"))
+    unique_ids = sorted({int(i) for i in ids})
+    for start in range(0, len(unique_ids), KEYSTATE_READ_CHUNK_SIZE):
+        conn.execute(text(f"INSERT INTO {table_name} (id) VALUES (:id)"),
+                     [{"id": i} for i in unique_ids[start:start + KEYSTATE_READ_CHUNK_SIZE]])
+    return table_name
+
+
+def _compact_keystates(keystate_df):
+    """
+    Convert keystate columns to KEYSTATE_DTYPES in place (columns containing NULLs stay float)
+    and relative_time_ms, if present, to float64 (NaN = missing) so every chunk has the same dtypes.
+    """
+    for column, dtype in KEYSTATE_DTYPES.items():
+        if column in keystate_df.columns and keystate_df[column].notna().all():
+            keystate_df[column] = keystate_df[column].astype(dtype)
+    if 'relative_time_ms' in keystate_df.columns:
+        keystate_df['relative_time_ms'] = keystate_df['relative_time_ms'].astype(np.float64)
+    return keystate_df
+
+
+def _read_keystate_chunks(conn, query, expand_runs=False, include_relative_times=False):
+    """
+    Run a keystate query in chunks of KEYSTATE_READ_CHUNK_SIZE rows, expanding keystate_run
+    rows per frame if expand_runs, and return the compacted chunks concatenated.
+    """
+    chunks = []
+    for chunk in pd.read_sql(text(query), conn, chunksize=KEYSTATE_READ_CHUNK_SIZE):
+        if expand_runs:
+            chunk = _expand_keystate_runs(chunk, include_relative_times)
+        if not chunk.empty or not chunks:
+            chunks.append(_compact_keystates(chunk))
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat([chunk for chunk in chunks if not chunk.empty], ignore_index=True)
+
+
+def _load_keystate_runs(conn, trial_ids, include_relative_times=False):
+    """
+    Load run-length encoded keystates (keystate_run table, written when the server runs with
+    KEYSTATE_STORAGE_MODE = 'rle') for the given trial ids and expand them to the same
+    per-frame columns as the keystate table: frame, f_pressed, j_pressed, trial_id
+    (plus relative_time_ms if include_relative_times).
+    Returns an empty DataFrame if the database has no keystate_run table.
+    """
+    columns = ['frame', 'f_pressed', 'j_pressed', 'trial_id'] + (['relative_time_ms'] if include_relative_times else [])
+    if not trial_ids or not inspect(conn).has_table('keystate_run'):
+        return pd.DataFrame(columns=columns)
+    selected = _stage_ids(conn, "selected_trial_ids", trial_ids)
+    run_query = f"""
+        SELECT ksr.trial_id, ksr.start_frame, ksr.end_frame, ksr.f_pressed, ksr.j_pressed, ksr.relative_time_ms
+        FROM keystate_run ksr
+        JOIN {selected} sel ON sel.id = ksr.trial_id
+        ORDER BY ksr.id
+    """
+    return _read_keystate_chunks(conn, run_query, expand_runs=True, include_relative_times=include_relative_times)
+
+
+def _expand_keystate_runs(run_df, include_relative_times=False):
+    """Expand keystate_run rows (trial_id, start_frame, end_frame, f_pressed, j_pressed, relative_time_ms) per frame."""
+    columns = ['frame', 'f_pressed', 'j_pressed', 'trial_id'] + (['relative_time_ms'] if include_relative_times else [])
+    if run_df.empty:
+        return pd.DataFrame(columns=columns)
+
+    # Expand each run [start_frame, end_frame] into one row per frame
+    lengths = (run_df['end_frame'] - run_df['start_frame'] + 1).to_numpy()
+    run_starts_in_output = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    frame_offsets = np.arange(lengths.sum()) - run_starts_in_output
+    expanded = pd.DataFrame({
+        'frame': np.repeat(run_df['start_frame'].to_numpy(), lengths) + frame_offsets,
+        'f_pressed': np.repeat(run_df['f_pressed'].to_numpy(), lengths),
+        'j_pressed': np.repeat(run_df['j_pressed'].to_numpy(), lengths),
+        'trial_id': np.repeat(run_df['trial_id'].to_numpy(), lengths),
+    })
+    if include_relative_times:
+        # Each run stores its frames' times as packed little-endian float64 (NaN = missing), or NULL
+        expanded['relative_time_ms'] = np.concatenate([
+            np.frombuffer(blob, dtype='<f8') if blob is not None else np.full(length, np.nan)
+            for blob, length in zip(run_df['relative_time_ms'], lengths)
+        ])
+    return expanded
+
+
 def extract_human_data(db_path, path_to_data, exp_trial_prefixes=None, fam_trial_prefixes=None, 
-                       allow_incomplete_sessions=False, session_ids=None): 
+                       allow_incomplete_sessions=False, session_ids=None, cache_dir=None): 
     """
     Extract human experiment data from database and match with trial data files.
     
@@ -57,6 +161,10 @@ def extract_human_data(db_path, path_to_data, exp_trial_prefixes=None, fam_trial
         fam_trial_prefixes: List of prefixes for familiarization trials (e.g., ['F'])
         allow_incomplete_sessions: If True, include sessions that are not marked as completed
         session_ids: List of specific session IDs to include (None means include all matching sessions)
+        cache_dir: Optional directory for an on-disk Parquet cache (requires pyarrow). Reruns with an
+            unchanged database and dataset folder load the cached results; otherwise only keystates
+            stored since the last run are read from the database (see _refresh_cached_keystates).
+            None reads everything on every call.
     
     Returns:
         tuple: (session_df, trial_df, keystate_df, rgplot_df, valid_trial_ids, global_trial_names)
@@ -67,6 +175,10 @@ def extract_human_data(db_path, path_to_data, exp_trial_prefixes=None, fam_trial
     if fam_trial_prefixes is None:
         fam_trial_prefixes = ['F']
 
+    if cache_dir is not None:
+        return _extract_human_data_cached(db_path, path_to_data, exp_trial_prefixes,
+                                          allow_incomplete_sessions, session_ids, cache_dir)
+
     # Step 1: Connect to the database
     engine = create_engine(f"sqlite:///{db_path}")  # Assuming SQLite
 
@@ -75,6 +187,17 @@ def extract_human_data(db_path, path_to_data, exp_trial_prefixes=None, fam_trial
     if allowed_repeat_trial_names:
         print(f"Trials allowed to repeat (from repeat.csv): {sorted(allowed_repeat_trial_names)}")
 
+    # One connection throughout: the selected ids are staged in its temporary tables
+    with engine.connect() as conn:
+        session_df = _read_sessions(conn, allow_incomplete_sessions, session_ids)
+        print(f"Found {len(session_df)} sessions (allow_incomplete={allow_incomplete_sessions}, session_ids={session_ids})")
+        trial_df = _read_trials(conn, session_df)
+        return _assemble_human_data(session_df, trial_df, lambda trial_ids: _read_keystates(conn, trial_ids),
+                                    path_to_data, exp_trial_prefixes, allowed_repeat_trial_names)
+
+
+def _read_sessions(conn, allow_incomplete_sessions, session_ids):
+    """Sessions selected by extract_human_data (not ignored; completed unless allow_incomplete_sessions)."""
     # Step 2: Load session data with optional filtering
     if allow_incomplete_sessions:
         # Include incomplete sessions, but still exclude ignored data
@@ -93,22 +216,24 @@ def extract_human_data(db_path, path_to_data, exp_trial_prefixes=None, fam_trial
     
     # Filter by specific session IDs if provided
     if session_ids is not None:
-        session_ids_str = ','.join(map(str, session_ids))
-        session_query += f" AND id IN ({session_ids_str})"
+        selected = _stage_ids(conn, "selected_session_ids", session_ids)
+        session_query += f" AND id IN (SELECT id FROM {selected})"
 
-    session_df = pd.read_sql(session_query, engine)
-    print(f"Found {len(session_df)} sessions (allow_incomplete={allow_incomplete_sessions}, session_ids={session_ids})")
+    return pd.read_sql(text(session_query + " ORDER BY id"), conn)
 
+
+def _read_trials(conn, session_df):
+    """Completed experimental trials of the given sessions (legacy databases get default repeat/symmetry columns)."""
     # # Step 4: Load trial data and map `global_trial_name`
     # Only get trials from the selected sessions
     if len(session_df) > 0:
-        session_ids_list = session_df['session_id'].tolist()
-        session_ids_str = ','.join(map(str, session_ids_list))
+        selected = _stage_ids(conn, "selected_session_ids", session_df['session_id'])
         trial_query = f"""
             SELECT id AS trial_id, session_id, trial_index, global_trial_name, score,
                    repeat_instance_index, symmetry_transform, is_repeated
             FROM trial
-            WHERE trial_type != 'ftrial' AND completed = 1 AND session_id IN ({session_ids_str})
+            WHERE trial_type != 'ftrial' AND completed = 1 AND session_id IN (SELECT id FROM {selected})
+            ORDER BY id
         """
     else:
         # No sessions, so no trials
@@ -120,25 +245,54 @@ def extract_human_data(db_path, path_to_data, exp_trial_prefixes=None, fam_trial
         """
     
     try:
-        trial_df = pd.read_sql(trial_query, engine)
+        trial_df = pd.read_sql(text(trial_query), conn)
     except Exception as e:
         if "no such column" in str(e).lower() or "repeat_instance_index" in str(e):
             # Legacy DB without repeat/symmetry columns
             if len(session_df) > 0:
-                session_ids_str = ','.join(map(str, session_df['session_id'].tolist()))
                 trial_query_legacy = f"""
                     SELECT id AS trial_id, session_id, trial_index, global_trial_name, score
                     FROM trial
-                    WHERE trial_type != 'ftrial' AND completed = 1 AND session_id IN ({session_ids_str})
+                    WHERE trial_type != 'ftrial' AND completed = 1 AND session_id IN (SELECT id FROM {selected})
+                    ORDER BY id
                 """
             else:
                 trial_query_legacy = "SELECT id AS trial_id, session_id, trial_index, global_trial_name, score FROM trial WHERE 1=0"
-            trial_df = pd.read_sql(trial_query_legacy, engine)
+            trial_df = pd.read_sql(text(trial_query_legacy), conn)
             trial_df["repeat_instance_index"] = 0
             trial_df["symmetry_transform"] = None
             trial_df["is_repeated"] = False
         else:
             raise
+    return trial_df
+
+
+def _read_keystates(conn, trial_ids):
+    """Per-frame keystates (keystate rows, then expanded keystate_run rows) of the given trials, in KEYSTATE_DTYPES."""
+    selected = _stage_ids(conn, "selected_trial_ids", trial_ids)
+    keystate_query = f"""
+        SELECT ks.frame, ks.f_pressed, ks.j_pressed, ks.trial_id
+        FROM keystate ks
+        JOIN {selected} sel ON sel.id = ks.trial_id
+        ORDER BY ks.id
+    """
+    keystate_df = _read_keystate_chunks(conn, keystate_query)
+
+    # Run-length encoded keystates are expanded to the same per-frame view
+    run_keystate_df = _load_keystate_runs(conn, trial_ids)
+    if not run_keystate_df.empty:
+        keystate_df = run_keystate_df if keystate_df.empty else pd.concat([keystate_df, run_keystate_df], ignore_index=True)
+    return keystate_df
+
+
+def _assemble_human_data(session_df, trial_df, load_keystates, path_to_data, exp_trial_prefixes,
+                         allowed_repeat_trial_names, rg_outcomes=None):
+    """
+    Everything extract_human_data does after reading sessions and trials: resolve duplicate
+    trials and keystate frames, add outcomes and build rgplot_df. load_keystates(trial_ids)
+    returns the raw per-frame keystates of the given trials; rg_outcomes ({folder: rg_outcome},
+    see _load_rg_outcomes) avoids re-reading the trial folders.
+    """
     # Normalize repeat_instance_index: None -> 0 (non-repeated or legacy DB)
     if "repeat_instance_index" in trial_df.columns:
         trial_df["repeat_instance_index"] = trial_df["repeat_instance_index"].fillna(0).astype(int)
@@ -152,53 +306,7 @@ def extract_human_data(db_path, path_to_data, exp_trial_prefixes=None, fam_trial
     trial_df = pd.merge(trial_df, session_df, left_on="session_id", right_on="session_id")
 
     # Check for duplicate global_trial_name within a session (repeated runs of same trial)
-    dup_mask = trial_df.duplicated(subset=['session_id', 'global_trial_name'], keep=False)
-    if dup_mask.any():
-        dup_rows = trial_df[dup_mask].sort_values(['session_id', 'global_trial_name', 'trial_id'])
-        # For each (session_id, global_trial_name), either keep all rows (allowed repeats) or resolve to one
-        def _resolve_trial_group(g):
-            name = g['global_trial_name'].iloc[0]
-            if name in allowed_repeat_trial_names:
-                # Allowed repeats: keep one row per (session_id, global_trial_name, repeat_instance_index).
-                # Error only on score discrepancy (different scores). Otherwise pick one: prefer the row with a score if exactly one has it, else pick any.
-                def _keep_one_instance(h):
-                    with_score = h[h['score'].notna()]
-                    scores = h['score'].dropna()
-                    if scores.nunique() > 1:
-                        raise ValueError(
-                            "Duplicate trials for the same (session, global_trial_name, repeat_instance_index) "
-                            "have different scores (score discrepancy). This must be resolved manually.\n"
-                            f"Offending rows:\n{h}"
-                        )
-                    if len(with_score) == 1:
-                        return with_score.iloc[[0]]
-                    return h.sort_values('trial_id').iloc[[-1]]
-                return (
-                    g.groupby('repeat_instance_index', as_index=False, group_keys=False)
-                    .apply(_keep_one_instance)
-                )
-            scores = g['score'].astype(float)
-            if scores.nunique() > 1:
-                raise ValueError(
-                    f"Duplicate trials found for global_trial_name={name!r} within a session "
-                    "but with different scores, and this trial is not in repeat.csv. "
-                    "Either add it to repeat.csv if repeats are intended, or resolve manually.\n"
-                    f"Offending rows:\n{g}"
-                )
-            return g.sort_values('trial_id').iloc[[-1]]
-
-        resolved = (
-            dup_rows
-            .groupby(['session_id', 'global_trial_name'], as_index=False, group_keys=False)
-            .apply(_resolve_trial_group)
-        )
-        trial_df = pd.concat(
-            [
-                trial_df[~dup_mask],
-                resolved
-            ],
-            ignore_index=True
-        )
+    trial_df = _resolve_duplicate_trials(trial_df, allowed_repeat_trial_names)
 
     # Symmetry check: for each (global_trial_name, repeat_instance_index), symmetry_transform must be the same for all participants
     if "symmetry_transform" in trial_df.columns:
@@ -223,47 +331,12 @@ def extract_human_data(db_path, path_to_data, exp_trial_prefixes=None, fam_trial
         print("WARNING: No valid trial IDs found. Returning empty DataFrames.")
         keystate_df = pd.DataFrame(columns=['frame', 'f_pressed', 'j_pressed', 'trial_id'])
     else:
-        keystate_query = f"""
-            SELECT ks.frame, ks.f_pressed, ks.j_pressed, ks.trial_id
-            FROM keystate ks
-            WHERE ks.trial_id IN ({', '.join(map(str, valid_trial_ids))})
-        """
-        keystate_df = pd.read_sql(keystate_query, engine)
+        keystate_df = load_keystates(valid_trial_ids)
 
         # Handle duplicate frame within a trial_id:
         # - If f_pressed / j_pressed are identical for the duplicates, keep a single row
         # - If they differ, raise an error
-        dup_keystate_mask = keystate_df.duplicated(subset=['trial_id', 'frame'], keep=False)
-        if dup_keystate_mask.any():
-            dup_rows = keystate_df[dup_keystate_mask].sort_values(['trial_id', 'frame'])
-
-            def _resolve_keystate_group(g):
-                # Check if all key states are identical
-                same_f = g['f_pressed'].nunique() == 1
-                same_j = g['j_pressed'].nunique() == 1
-                if same_f and same_j:
-                    # Keep a single representative row
-                    return g.iloc[[0]]
-                raise ValueError(
-                    "Raw keystate data contains conflicting rows for the same trial_id/frame "
-                    "with different key states. This must be resolved before exporting.\n"
-                    f"Offending rows:\n{g}"
-                )
-
-            resolved_ks = (
-                dup_rows
-                .groupby(['trial_id', 'frame'], as_index=False, group_keys=False)
-                .apply(_resolve_keystate_group)
-            )
-
-            # Drop all original duplicates and append the resolved uniques
-            keystate_df = pd.concat(
-                [
-                    keystate_df[~dup_keystate_mask],
-                    resolved_ks
-                ],
-                ignore_index=True
-            )
+        keystate_df = _resolve_duplicate_keystates(keystate_df)
 
     # Merge keystate data with global_trial_name and repeat_instance_index
     merge_cols = ["trial_id", "global_trial_name", "repeat_instance_index"]
@@ -285,13 +358,13 @@ def extract_human_data(db_path, path_to_data, exp_trial_prefixes=None, fam_trial
         rgplot_df = pd.DataFrame(columns=['global_trial_name', 'frame'])
     else:
         # Convert boolean to integer for aggregation
-        keystate_df["f_pressed"] = keystate_df["f_pressed"].astype(int)
-        keystate_df["j_pressed"] = keystate_df["j_pressed"].astype(int)
+        keystate_df["f_pressed"] = keystate_df["f_pressed"].astype(np.int8)
+        keystate_df["j_pressed"] = keystate_df["j_pressed"].astype(np.int8)
 
-        keystate_df["red"] = ((keystate_df["f_pressed"] == 1) & (keystate_df["j_pressed"] == 0)).astype(int)
-        keystate_df["green"] = ((keystate_df["j_pressed"] == 1) & (keystate_df["f_pressed"] == 0)).astype(int)
+        keystate_df["red"] = ((keystate_df["f_pressed"] == 1) & (keystate_df["j_pressed"] == 0)).astype(np.int8)
+        keystate_df["green"] = ((keystate_df["j_pressed"] == 1) & (keystate_df["f_pressed"] == 0)).astype(np.int8)
         keystate_df["uncertain"] = ((keystate_df["j_pressed"] == 0) & (keystate_df["f_pressed"] == 0)
-                                    | (keystate_df["j_pressed"] == 1) & (keystate_df["f_pressed"] == 1)).astype(int)
+                                    | (keystate_df["j_pressed"] == 1) & (keystate_df["f_pressed"] == 1)).astype(np.int8)
         # Group by global_trial_name and frame, calculate mean
         rgplot_df = (
             keystate_df.groupby(["global_trial_name", "frame"])
@@ -312,15 +385,18 @@ def extract_human_data(db_path, path_to_data, exp_trial_prefixes=None, fam_trial
     if len(e_folders) > 0:
         print(f"Sample folder names: {e_folders[:5]}")
     
-    e_paths = [os.path.join(os.path.join(path_to_data, entry), 'simulation_data.json') for entry in e_folders]
-    rg_outcomes = []
-    for e_path in e_paths:
-        with open(e_path, 'r') as f:
-            data = json.load(f)
-            rg_outcomes.append(data.get("rg_outcome", ""))
+    if rg_outcomes is None:
+        e_paths = [os.path.join(os.path.join(path_to_data, entry), 'simulation_data.json') for entry in e_folders]
+        folder_outcomes = []
+        for e_path in e_paths:
+            with open(e_path, 'r') as f:
+                data = json.load(f)
+                folder_outcomes.append(data.get("rg_outcome", ""))
+    else:
+        folder_outcomes = [rg_outcomes.get(entry, "") for entry in e_folders]
     rg_outcome_df = pd.DataFrame({
         "global_trial_name": e_folders,
-        "rg_outcome": rg_outcomes,
+        "rg_outcome": folder_outcomes,
         
     })
     print(f"Created rg_outcome_df with {len(rg_outcome_df)} rows")
@@ -361,17 +437,478 @@ def extract_human_data(db_path, path_to_data, exp_trial_prefixes=None, fam_trial
     return session_df, trial_df, keystate_df, rgplot_df, valid_trial_ids, global_trial_names
 
 
-def save_human_data_by_trial(trial_df, keystate_df, path_to_data):
+def _resolve_duplicate_trials(trial_df, allowed_repeat_trial_names):
+    """
+    Resolve trial rows that share (session_id, global_trial_name):
+
+    - trials in repeat.csv keep one row per repeat_instance_index: the only row
+      with a score if exactly one has a score, else the latest (highest trial_id)
+    - other trials keep the latest row
+    - rows of the same trial (and instance, for repeats) with different scores
+      raise ValueError; duplicated rows without a global_trial_name are dropped
+
+    Resolved rows are appended after the unique ones, ordered by session, trial
+    name and repeat instance.
+    """
+    dup_mask = trial_df.duplicated(subset=['session_id', 'global_trial_name'], keep=False)
+    if not dup_mask.any():
+        return trial_df
+    dup_rows = trial_df[dup_mask].sort_values(['session_id', 'global_trial_name', 'trial_id'])
+    dup_rows = dup_rows[dup_rows['global_trial_name'].notna()]
+
+    # Group every row by its (session, name) group number in sorted order and, for
+    # allowed repeats, its repeat instance (-1 for every row of other trials)
+    is_allowed_repeat = dup_rows['global_trial_name'].isin(allowed_repeat_trial_names).to_numpy()
+    name_group = dup_rows.groupby(['session_id', 'global_trial_name'], sort=False).ngroup().to_numpy()
+    instance = np.where(is_allowed_repeat, dup_rows['repeat_instance_index'].to_numpy(), -1)
+    group_keys = [name_group, instance]
+    scores = dup_rows['score'].astype(float)
+    num_scores = scores.groupby(group_keys, sort=False).transform('nunique').to_numpy()
+
+    conflicts = np.flatnonzero(num_scores > 1)
+    if len(conflicts):
+        # Report the first conflicting group in (session, name, instance) order
+        first = conflicts[np.lexsort((instance[conflicts], name_group[conflicts]))[0]]
+        offending = dup_rows[(name_group == name_group[first]) & (instance == instance[first])]
+        if is_allowed_repeat[first]:
+            raise ValueError(
+                "Duplicate trials for the same (session, global_trial_name, repeat_instance_index) "
+                "have different scores (score discrepancy). This must be resolved manually.\n"
+                f"Offending rows:\n{offending}"
+            )
+        raise ValueError(
+            f"Duplicate trials found for global_trial_name={offending['global_trial_name'].iloc[0]!r} within a session "
+            "but with different scores, and this trial is not in repeat.csv. "
+            "Either add it to repeat.csv if repeats are intended, or resolve manually.\n"
+            f"Offending rows:\n{offending}"
+        )
+
+    # Rows are sorted by trial_id within each group, so the last row of a group is the latest
+    is_latest = ~pd.DataFrame({'group': name_group, 'instance': instance}).duplicated(keep='last').to_numpy()
+    # Allowed repeats prefer the only scored row of an instance
+    has_score = scores.notna().to_numpy()
+    num_scored = pd.Series(has_score).groupby(group_keys, sort=False).transform('sum').to_numpy()
+    keep = np.where(is_allowed_repeat & (num_scored == 1), has_score, is_latest)
+
+    # Within a trial, kept instances are ordered by repeat_instance_index, except when
+    # every instance had a single row (nothing dropped): then they stay in trial_id order
+    has_dropped_rows = pd.Series(~keep).groupby(name_group, sort=False).transform('any').to_numpy()
+    keep_positions = np.flatnonzero(keep)
+    order_in_trial = np.where(has_dropped_rows, instance, 0)[keep_positions]
+    keep_positions = keep_positions[np.lexsort((order_in_trial, name_group[keep_positions]))]
+    return pd.concat([trial_df[~dup_mask], dup_rows.iloc[keep_positions]], ignore_index=True)
+
+
+def _resolve_duplicate_keystates(keystate_df):
+    """
+    Resolve keystate rows that share (trial_id, frame): keep the first row if all
+    of them have the same f_pressed and j_pressed, else raise ValueError.
+    Resolved rows are appended after the unique ones, ordered by trial and frame.
     """
-    Save human keystate data as separate CSV files for each trial.
-    For trials with repeats (multiple instances per participant), saves one CSV per instance:
-    - Instance 0 (first occurrence): human_data.csv
-    - Instance 1, 2, ...: human_data_rep1.csv, human_data_rep2.csv, ...
+    dup_mask = keystate_df.duplicated(subset=['trial_id', 'frame'], keep=False)
+    if not dup_mask.any():
+        return keystate_df
+    dup_rows = keystate_df[dup_mask].sort_values(['trial_id', 'frame'])
+    dup_rows = dup_rows.dropna(subset=['trial_id', 'frame'])
+
+    groups = dup_rows.groupby(['trial_id', 'frame'], sort=False)
+    conflicting = ((groups['f_pressed'].transform('nunique') != 1)
+                   | (groups['j_pressed'].transform('nunique') != 1)).to_numpy()
+    if conflicting.any():
+        # Rows are sorted by (trial_id, frame), so the first conflicting row starts the first conflicting group
+        first = dup_rows.iloc[np.flatnonzero(conflicting)[0]]
+        offending = dup_rows[(dup_rows['trial_id'] == first['trial_id']) & (dup_rows['frame'] == first['frame'])]
+        raise ValueError(
+            "Raw keystate data contains conflicting rows for the same trial_id/frame "
+            "with different key states. This must be resolved before exporting.\n"
+            f"Offending rows:\n{offending}"
+        )
+
+    # Drop all original duplicates and append the first row of each group
+    resolved = dup_rows.drop_duplicates(subset=['trial_id', 'frame'], keep='first')
+    return pd.concat([keystate_df[~dup_mask], resolved], ignore_index=True)
+
+
+def _load_rg_outcomes(path_to_data):
+    """rg_outcome of every trial folder (familiarization and experimental) in path_to_data, keyed by folder name."""
+    rg_outcomes = {}
+    for entry in sorted(os.listdir(path_to_data)):
+        sim_path = os.path.join(path_to_data, entry, 'simulation_data.json')
+        if os.path.exists(sim_path):
+            with open(sim_path, 'r') as f:
+                rg_outcomes[entry] = json.load(f).get("rg_outcome", "")
+    return rg_outcomes
+
+
+# On-disk cache for extract_human_data(cache_dir=...). The cache directory holds
+# Parquet copies of the keystate tables (the bulk of the database; rows are only
+# ever inserted, so each run appends the rows added since the previous one as a
+# new part), the results of each distinct set of arguments, and manifest.json
+# recording both. Sessions and trials are small and can be edited by hand
+# (ignore_data), so they are re-read whenever the database changed. Bump the
+# version whenever extract_human_data's processing changes so existing caches
+# are rebuilt.
+HUMAN_DATA_CACHE_VERSION = 2
+HUMAN_DATA_CACHE_MAX_PARTS = 32  # Keystate Parquet parts per table before they are compacted into one
+
+_KEYSTATE_COLUMNS = ["frame", "f_pressed", "j_pressed", "trial_id"]
+
+
+def _extract_human_data_cached(db_path, path_to_data, exp_trial_prefixes, allow_incomplete_sessions,
+                               session_ids, cache_dir):
+    """extract_human_data backed by the on-disk cache in cache_dir."""
+    try:
+        _import_pyarrow()
+    except ImportError as e:
+        raise ImportError("extract_human_data(cache_dir=...) requires pyarrow (pip install pyarrow).") from e
+    os.makedirs(cache_dir, exist_ok=True)
+    engine = create_engine(f"sqlite:///{db_path}")  # Assuming SQLite
+    manifest = _load_cache_manifest(cache_dir, db_path)
+    database_state = _database_state(engine, db_path)
+    dataset_state = dataset_fingerprint(os.path.abspath(path_to_data))
+    result_key = hashlib.sha1(json.dumps(
+        [list(exp_trial_prefixes), bool(allow_incomplete_sessions), sorted(session_ids) if session_ids is not None else None]
+    ).encode()).hexdigest()[:16]
+
+    cached_result = manifest["results"].get(result_key)
+    if (cached_result is not None and cached_result["database_state"] == database_state
+            and cached_result["dataset_fingerprint"] == dataset_state):
+        try:
+            result = _load_cached_result(cache_dir, result_key, cached_result)
+            print(f"Loaded cached human data from {cache_dir} (database and dataset unchanged)")
+            return result
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not read cached human data ({e}); rebuilding it")
+
+    if manifest.get("dataset_fingerprint") != dataset_state or "rg_outcomes" not in manifest:
+        manifest["rg_outcomes"] = _load_rg_outcomes(path_to_data)
+        manifest["dataset_fingerprint"] = dataset_state
+
+    allowed_repeat_trial_names = _load_allowed_repeat_trial_names(path_to_data)
+    if allowed_repeat_trial_names:
+        print(f"Trials allowed to repeat (from repeat.csv): {sorted(allowed_repeat_trial_names)}")
+    with engine.connect() as conn:
+        keystates = _refresh_cached_keystates(conn, cache_dir, manifest, database_state)
+        session_df = _read_sessions(conn, allow_incomplete_sessions, session_ids)
+        print(f"Found {len(session_df)} sessions (allow_incomplete={allow_incomplete_sessions}, session_ids={session_ids})")
+        trial_df = _read_trials(conn, session_df)
+
+    def load_keystates(trial_ids):
+        # Same rows, order, index and dtypes as _read_keystates
+        return _compact_keystates(keystates[keystates["trial_id"].isin(trial_ids)].reset_index(drop=True))
+
+    result = _assemble_human_data(session_df, trial_df, load_keystates, path_to_data, exp_trial_prefixes,
+                                  allowed_repeat_trial_names, rg_outcomes=manifest["rg_outcomes"])
+
+    # Results computed from an older state of the database can never be served again
+    for key in [key for key, entry in manifest["results"].items() if entry["database_state"] != database_state]:
+        shutil.rmtree(os.path.join(cache_dir, "results", key), ignore_errors=True)
+        del manifest["results"][key]
+    manifest["results"][result_key] = _save_cached_result(cache_dir, result_key, result)
+    manifest["results"][result_key].update(database_state=database_state, dataset_fingerprint=dataset_state)
+    _save_cache_manifest(cache_dir, manifest)
+    return result
+
+
+def _load_cache_manifest(cache_dir, db_path):
+    """The cache manifest, or a fresh one if it is missing, from another version or for another database."""
+    fresh = {"version": HUMAN_DATA_CACHE_VERSION, "db_path": os.path.abspath(db_path), "tables": {}, "results": {}}
+    try:
+        with open(os.path.join(cache_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return fresh
+    if manifest.get("version") != HUMAN_DATA_CACHE_VERSION or manifest.get("db_path") != fresh["db_path"]:
+        return fresh
+    return manifest
+
+
+def _save_cache_manifest(cache_dir, manifest):
+    # Write-then-rename so a crash never leaves a half-written manifest
+    path = os.path.join(cache_dir, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def _database_state(engine, db_path):
+    """
+    Fingerprint of the database: row count and highest id of every table
+    extract_human_data reads, plus size and mtime of the SQLite file and of its
+    WAL (while it holds uncheckpointed writes; SQLite recreates an empty WAL
+    whenever a connection opens), which also change on edits that keep counts
+    and ids (e.g. setting ignore_data).
+    """
+    inspector = inspect(engine)
+    state = {}
+    with engine.connect() as conn:
+        for table_name in ("redgreen_session", "trial", "keystate", "keystate_run"):
+            if inspector.has_table(table_name):
+                state[table_name] = list(conn.execute(text(f"SELECT COUNT(*), MAX(id) FROM {table_name}")).one())
+    for path in (db_path, db_path + "-wal"):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if st.st_size:
+            state[os.path.basename(path)] = [st.st_size, st.st_mtime_ns]
+    return state
+
+
+def _refresh_cached_keystates(conn, cache_dir, manifest, database_state):
+    """
+    Append keystate and keystate_run rows added since the previous run to their
+    cached Parquet parts and return every stored frame, in the order _read_keystates
+    returns them (keystate rows by id, then expanded keystate_run rows by id).
+    """
+    frames = [
+        _refresh_append_only_table(conn, cache_dir, manifest["tables"], database_state, "keystate", """
+            SELECT ks.id, ks.frame, ks.f_pressed, ks.j_pressed, ks.trial_id
+            FROM keystate ks
+            WHERE ks.id > :after AND ks.id <= :upto
+            ORDER BY ks.id
+        """, lambda rows: rows[_KEYSTATE_COLUMNS]),
+        _refresh_append_only_table(conn, cache_dir, manifest["tables"], database_state, "keystate_run", """
+            SELECT ksr.id, ksr.trial_id, ksr.start_frame, ksr.end_frame, ksr.f_pressed, ksr.j_pressed
+            FROM keystate_run ksr
+            WHERE ksr.id > :after AND ksr.id <= :upto
+            ORDER BY ksr.id
+        """, _expand_keystate_runs),
+    ]
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=_KEYSTATE_COLUMNS)
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def _refresh_append_only_table(conn, cache_dir, tables, database_state, table_name, query, to_frames):
+    """
+    Bring the cached Parquet parts of an insert-only keystate table up to date and
+    return all of its per-frame rows. Rows with an id above the previous run's
+    highest id become a new part; to_frames converts each chunk of them to the
+    keystate columns, which are stored in KEYSTATE_DTYPES.
+    If the cached rows plus the new ones do not add up to the table's row count
+    (rows deleted, or committed late with a lower id), the table is re-read in full.
+    """
+    previous = tables.get(table_name, {"max_id": 0, "rows": 0, "parts": []})
+    if table_name not in database_state:
+        count, max_id = 0, 0
+    else:
+        count, max_id = database_state[table_name][0], database_state[table_name][1] or 0
+    cached = previous
+    if max_id < cached["max_id"] or not all(os.path.exists(os.path.join(cache_dir, part)) for part in cached["parts"]):
+        cached = {"max_id": 0, "rows": 0, "parts": []}
+
+    delta = pd.DataFrame()
+    if count:
+        num_rows, delta = _read_table_delta(conn, query, cached["max_id"], max_id, to_frames)
+        if cached["rows"] + num_rows != count:
+            cached = {"max_id": 0, "rows": 0, "parts": []}
+            num_rows, delta = _read_table_delta(conn, query, 0, max_id, to_frames)
+    elif cached["rows"]:
+        cached = {"max_id": 0, "rows": 0, "parts": []}
+
+    frames = [pd.read_parquet(os.path.join(cache_dir, part)) for part in cached["parts"]]
+    parts = list(cached["parts"])
+    if not delta.empty:
+        frames.append(delta)
+        part = frames[-1]
+        if len(parts) >= HUMAN_DATA_CACHE_MAX_PARTS:
+            # Compact everything into a single part
+            parts, part = [], pd.concat(frames, ignore_index=True)
+        part_name = f"{table_name}-{max_id:012d}.parquet"
+        part.to_parquet(os.path.join(cache_dir, part_name), index=False)
+        parts.append(part_name)
+    for stale in set(previous["parts"]) - set(parts):
+        try:
+            os.remove(os.path.join(cache_dir, stale))
+        except FileNotFoundError:
+            pass
+
+    tables[table_name] = {"max_id": max_id, "rows": count, "parts": parts}
+    if not frames:
+        return pd.DataFrame(columns=_KEYSTATE_COLUMNS)
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def _read_table_delta(conn, query, after, upto, to_frames):
+    """Rows with after < id <= upto, read in chunks; returns (number of table rows, their compacted per-frame rows)."""
+    num_rows, chunks = 0, []
+    for chunk in pd.read_sql(text(query), conn, params={"after": after, "upto": upto}, chunksize=KEYSTATE_READ_CHUNK_SIZE):
+        num_rows += len(chunk)
+        if not chunk.empty:
+            chunks.append(_compact_keystates(to_frames(chunk.drop(columns="id")).reset_index(drop=True)))
+    if not chunks:
+        return num_rows, pd.DataFrame()
+    return num_rows, pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+
+def _save_cached_result(cache_dir, result_key, result):
+    """Write extract_human_data's DataFrames to cache_dir/results/<key>/ and return their manifest entry."""
+    session_df, trial_df, keystate_df, rgplot_df, valid_trial_ids, global_trial_names = result
+    result_dir = os.path.join(cache_dir, "results", result_key)
+    os.makedirs(result_dir, exist_ok=True)
+    for name, df in zip(("session", "trial", "keystate", "rgplot"), (session_df, trial_df, keystate_df, rgplot_df)):
+        df.to_parquet(os.path.join(result_dir, f"{name}.parquet"))
+    return {
+        "valid_trial_ids": [int(trial_id) for trial_id in valid_trial_ids],
+        "global_trial_names": [str(name) for name in global_trial_names],
+    }
+
+
+def _load_cached_result(cache_dir, result_key, entry):
+    result_dir = os.path.join(cache_dir, "results", result_key)
+    frames = [pd.read_parquet(os.path.join(result_dir, f"{name}.parquet")) for name in ("session", "trial", "keystate", "rgplot")]
+    return (*frames, list(entry["valid_trial_ids"]), list(entry["global_trial_names"]))
+
+
+def rescore_database(db_path, path_to_data, occlusion_frames=None, undo_counterbalance=False,
+                     include_timelines=False):
+    """
+    Recompute the score of every completed trial (familiarization and experimental) in a
+    database in one vectorized pass (see redgreen_scoring.py), e.g. to check stored scores or
+    to try another scoring rule on a finished study.
+
+    Every stored keystate frame is counted, exactly as /save_data counted the frames it
+    received, so `score` reproduces `stored_score` unless the scoring inputs changed.
+
+    Args:
+        db_path: Path to the SQLite database file
+        path_to_data: Path to the dataset folder the study ran on (for each trial's rg_outcome)
+        occlusion_frames: Optional {global_trial_name: [frame, ...]} such as the occlusion_frames
+            returned by extract_occlusion_data; adds occlusion_score, the score over those frames only
+        undo_counterbalance: If True, score the keys as physically pressed, i.e. swap F/J back on
+            counterbalanced trials. A response then scores the same whatever the trial's
+            counterbalance (see DUPLICATE_TRIALS_DIAGNOSIS.md, trials 753/754)
+        include_timelines: If True, also return per-frame cumulative score timelines
+
+    Returns:
+        pd.DataFrame with one row per completed trial: trial_id, session_id, trial_type,
+        global_trial_name, counterbalance, rg_outcome, num_frames, stored_score, score,
+        score_diff (score - stored_score), time_weighted_score and, if occlusion_frames is
+        given, occlusion_score. With include_timelines, a tuple (scores_df, timeline_df) where
+        timeline_df has one row per frame: trial_id, frame, cumulative_score and
+        cumulative_time_weighted_score.
+    """
+    engine = create_engine(f"sqlite:///{db_path}")  # Assuming SQLite
+
+    with engine.connect() as conn:
+        trial_df = pd.read_sql(text("""
+            SELECT id AS trial_id, session_id, trial_type, global_trial_name, counterbalance, score AS stored_score
+            FROM trial
+            WHERE completed = 1
+            ORDER BY id
+        """), conn)
+        trial_df['counterbalance'] = trial_df['counterbalance'].fillna(False).astype(bool)
+        trial_df['rg_outcome'] = trial_df['global_trial_name'].map(_load_rg_outcomes(path_to_data))
+        trial_ids = trial_df['trial_id'].tolist()
+
+        # Legacy databases have no relative_time_ms column: time-weighted scores then equal the plain ones
+        has_relative_times = any(col['name'] == 'relative_time_ms' for col in inspect(conn).get_columns('keystate'))
+        keystate_df = _read_keystate_chunks(conn, f"""
+            SELECT ks.trial_id, ks.frame, ks.f_pressed, ks.j_pressed,
+                   {'ks.relative_time_ms' if has_relative_times else 'NULL AS relative_time_ms'}
+            FROM keystate ks
+            JOIN trial t ON t.id = ks.trial_id
+            WHERE t.completed = 1
+        """)
+        run_keystate_df = _load_keystate_runs(conn, trial_ids, include_relative_times=True)
+    if not run_keystate_df.empty:
+        keystate_df = run_keystate_df if keystate_df.empty else pd.concat([keystate_df, run_keystate_df], ignore_index=True)
+    keystate_df = keystate_df.sort_values(['trial_id', 'frame'], kind='stable', ignore_index=True)
+
+    group_index = pd.Index(trial_df['trial_id']).get_indexer(keystate_df['trial_id'])
+    f_pressed = keystate_df['f_pressed'].to_numpy(dtype=bool)
+    j_pressed = keystate_df['j_pressed'].to_numpy(dtype=bool)
+    if undo_counterbalance:
+        swapped = trial_df['counterbalance'].to_numpy()[group_index]
+        f_pressed, j_pressed = np.where(swapped, j_pressed, f_pressed), np.where(swapped, f_pressed, j_pressed)
+    outcome_signs = trial_df['rg_outcome'].map(OUTCOME_SIGNS).fillna(0).to_numpy(dtype=np.int8)
+    durations = frame_durations_ms(keystate_df['relative_time_ms'].to_numpy(dtype=np.float64), group_index)
+
+    trial_df['num_frames'] = np.bincount(group_index, minlength=len(trial_df))
+    trial_df['score'] = score_trials(group_index, f_pressed, j_pressed, outcome_signs)
+    trial_df['score_diff'] = trial_df['score'] - trial_df['stored_score']
+    trial_df['time_weighted_score'] = score_trials(group_index, f_pressed, j_pressed, outcome_signs, weights=durations)
+    if occlusion_frames is not None:
+        occlusion_index = pd.MultiIndex.from_tuples(
+            [(name, frame) for name, frames in occlusion_frames.items() for frame in frames]
+        )
+        in_occlusion = pd.MultiIndex.from_arrays([
+            trial_df['global_trial_name'].to_numpy()[group_index], keystate_df['frame'].to_numpy()
+        ]).isin(occlusion_index)
+        trial_df['occlusion_score'] = score_trials(group_index, f_pressed, j_pressed, outcome_signs, window=in_occlusion)
+
+    num_changed = int((trial_df['score_diff'].abs() > 1e-9).sum())
+    print(f"Rescored {len(trial_df)} trials ({len(keystate_df)} keystate frames); {num_changed} differ from the stored score")
+    if not include_timelines:
+        return trial_df
+
+    timeline_df = pd.DataFrame({
+        'trial_id': keystate_df['trial_id'],
+        'frame': keystate_df['frame'],
+        'cumulative_score': cumulative_scores(group_index, f_pressed, j_pressed, outcome_signs),
+        'cumulative_time_weighted_score': cumulative_scores(
+            group_index, f_pressed, j_pressed, outcome_signs, weights=durations
+        ),
+    })
+    return trial_df, timeline_df
+
+
+# File formats supported by save_human_data_by_trial / load_human_data_by_trial.
+# 'parquet' and 'arrow' (Arrow IPC) are columnar, typed and require pyarrow.
+HUMAN_DATA_FILE_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+
+def _human_data_filename(rep_idx, file_format):
+    """Instance 0 -> human_data.<ext>, instance k -> human_data_rep{k}.<ext>."""
+    if file_format not in HUMAN_DATA_FILE_EXTENSIONS:
+        raise ValueError(f"Unknown human data file format '{file_format}'. Expected one of {list(HUMAN_DATA_FILE_EXTENSIONS)}")
+    stem = "human_data" if rep_idx == 0 else f"human_data_rep{rep_idx}"
+    return stem + HUMAN_DATA_FILE_EXTENSIONS[file_format]
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("The 'parquet' and 'arrow' human data formats require pyarrow (pip install pyarrow).") from e
+    return pyarrow
+
+
+def _human_data_to_arrow_table(trial_data):
+    """
+    Convert one (global_trial_name, repeat_instance_index) keystate frame to a typed Arrow table:
+    small integer columns and dictionary-encoded trial name / outcome strings.
+    """
+    pa = _import_pyarrow()
+    return pa.table({
+        "frame": pa.array(trial_data["frame"].to_numpy(), type=pa.int32()),
+        "red": pa.array(trial_data["red"].to_numpy(), type=pa.int8()),
+        "green": pa.array(trial_data["green"].to_numpy(), type=pa.int8()),
+        "uncertain": pa.array(trial_data["uncertain"].to_numpy(), type=pa.int8()),
+        "session_id": pa.array(trial_data["session_id"].to_numpy(), type=pa.int32()),
+        "rg_outcome": pa.array(trial_data["rg_outcome"].tolist(), type=pa.string()).dictionary_encode(),
+        "trial_id": pa.array(trial_data["trial_id"].to_numpy(), type=pa.int64()),
+        "global_trial_name": pa.array(trial_data["global_trial_name"].tolist(), type=pa.string()).dictionary_encode(),
+    })
+
+
+def save_human_data_by_trial(trial_df, keystate_df, path_to_data, file_format="csv"):
+    """
+    Save human keystate data as separate files for each trial.
+    For trials with repeats (multiple instances per participant), saves one file per instance:
+    - Instance 0 (first occurrence): human_data.<ext>
+    - Instance 1, 2, ...: human_data_rep1.<ext>, human_data_rep2.<ext>, ...
 
     Args:
         trial_df: DataFrame containing trial information with trial_id, session_id, global_trial_name, and optionally repeat_instance_index
         keystate_df: DataFrame containing keystate data with trial_id
         path_to_data: Path to the directory containing trial folders
+        file_format: 'csv' (default), or 'parquet' / 'arrow' for typed columnar files that
+            load_human_data_by_trial can memory-map (requires pyarrow)
 
     Returns:
         dict: Dictionary keyed by (global_trial_name, repeat_instance_index) of dataframes
@@ -379,6 +916,10 @@ def save_human_data_by_trial(trial_df, keystate_df, path_to_data):
     if trial_df.empty or keystate_df.empty:
         print("No trial or keystate data to save.")
         return {}
+    # Validate the format (and pyarrow availability) before doing any work
+    _human_data_filename(0, file_format)
+    if file_format != "csv":
+        _import_pyarrow()
 
     required_cols = ['trial_id', 'session_id', 'global_trial_name', 'rg_outcome']
     if 'repeat_instance_index' not in trial_df.columns:
@@ -450,16 +991,83 @@ def save_human_data_by_trial(trial_df, keystate_df, path_to_data):
     for (trial_name, rep_idx), group in keystate_with_session.groupby(['global_trial_name', 'repeat_instance_index']):
         keystate_by_trial[(trial_name, rep_idx)] = group.drop(columns=['repeat_instance_index'], errors='ignore').copy()
 
-    # Save: instance 0 -> human_data.csv, instance k -> human_data_rep{k}.csv
+    # Save: instance 0 -> human_data.<ext>, instance k -> human_data_rep{k}.<ext>
     for (trial_name, rep_idx), trial_data in keystate_by_trial.items():
-        if rep_idx == 0:
-            csv_filename = "human_data.csv"
+        filepath = os.path.join(path_to_data, trial_name, _human_data_filename(rep_idx, file_format))
+        if file_format == "csv":
+            trial_data.to_csv(filepath, index=False)
+        elif file_format == "parquet":
+            pa = _import_pyarrow()
+            pa.parquet.write_table(_human_data_to_arrow_table(trial_data), filepath)
         else:
-            csv_filename = f"human_data_rep{rep_idx}.csv"
-        csv_filepath = os.path.join(path_to_data, trial_name, csv_filename)
-        trial_data.to_csv(csv_filepath, index=False)
+            # Uncompressed Arrow IPC file: can be memory-mapped and read without copying
+            pa = _import_pyarrow()
+            table = _human_data_to_arrow_table(trial_data)
+            with pa.OSFile(filepath, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
 
-    print(f"Saved human data as CSV files in {path_to_data}")
+    print(f"Saved human data as {file_format} files in {path_to_data}")
+    return keystate_by_trial
+
+
+def load_human_data_by_trial(path_to_data, file_format="arrow", trial_names=None, as_arrow=False):
+    """
+    Load per-trial human data files written by save_human_data_by_trial.
+
+    Arrow IPC files are memory-mapped, so repeated loads (e.g. inside model-fitting loops)
+    are served from the OS page cache without parsing or copying; Parquet files are read
+    with memory mapping enabled. CSV is supported for files written in the default format.
+
+    Args:
+        path_to_data: Path to the directory containing trial folders
+        file_format: 'arrow' (default), 'parquet' or 'csv'
+        trial_names: Optional list of global_trial_names (folder names) to load; None loads all
+        as_arrow: If True, return pyarrow Tables (zero-copy) instead of pandas DataFrames
+
+    Returns:
+        dict: Dictionary keyed by (global_trial_name, repeat_instance_index), like save_human_data_by_trial
+    """
+    _human_data_filename(0, file_format)
+    if file_format != "csv" or as_arrow:
+        pa = _import_pyarrow()
+    extension = HUMAN_DATA_FILE_EXTENSIONS[file_format]
+
+    if trial_names is None:
+        trial_names = sorted(
+            entry for entry in os.listdir(path_to_data)
+            if os.path.isdir(os.path.join(path_to_data, entry))
+        )
+
+    keystate_by_trial = {}
+    for trial_name in trial_names:
+        trial_dir = os.path.join(path_to_data, trial_name)
+        if not os.path.isdir(trial_dir):
+            continue
+        for filename in os.listdir(trial_dir):
+            if not (filename.startswith("human_data") and filename.endswith(extension)):
+                continue
+            stem = filename[:-len(extension)]
+            if stem == "human_data":
+                rep_idx = 0
+            elif stem.startswith("human_data_rep") and stem[len("human_data_rep"):].isdigit():
+                rep_idx = int(stem[len("human_data_rep"):])
+            else:
+                continue
+
+            filepath = os.path.join(trial_dir, filename)
+            if file_format == "csv":
+                data = pd.read_csv(filepath)
+                if as_arrow:
+                    data = pa.Table.from_pandas(data, preserve_index=False)
+            else:
+                if file_format == "arrow":
+                    table = pa.ipc.open_file(pa.memory_map(filepath, "r")).read_all()
+                else:
+                    table = pa.parquet.read_table(filepath, memory_map=True)
+                data = table if as_arrow else table.to_pandas()
+            keystate_by_trial[(trial_name, rep_idx)] = data
+
+    print(f"Loaded {len(keystate_by_trial)} {file_format} human data files from {path_to_data}")
     return keystate_by_trial
 
 
@@ -565,64 +1173,145 @@ def print_demo_data(session_df, demographic_path):
     print(gender_counts)
 
 
-import os
-import numpy as np
+def _video_frame_chunks(npz_path, chunk_size=64):
+    """
+    Frames of the (T, M, N, 3) video stored as arr_0 in an .npz file, yielded as
+    consecutive (<= chunk_size, M, N, 3) arrays. The member is decompressed as a
+    stream, so only one chunk is in memory at a time; np.load would inflate the
+    whole video first.
+    """
+    with zipfile.ZipFile(npz_path) as archive, archive.open("arr_0.npy") as f:  # Replace "arr_0" if array name differs
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        if fortran_order or dtype.hasobject:
+            # Not laid out frame by frame: load it whole
+            video_data = np.load(npz_path)["arr_0"]
+            for start in range(0, video_data.shape[0], chunk_size):
+                yield video_data[start:start + chunk_size]
+            return
+        frame_shape = shape[1:]
+        frame_bytes = int(np.prod(frame_shape, dtype=np.int64)) * dtype.itemsize
+        for start in range(0, shape[0], chunk_size):
+            chunk = np.empty((min(chunk_size, shape[0] - start), *frame_shape), dtype=dtype)
+            # Frame-sized reads: a single read() of the whole chunk would briefly hold it twice more
+            for frame in chunk:
+                frame[...] = np.frombuffer(f.read(frame_bytes), dtype=dtype).reshape(frame_shape)
+            yield chunk
+
+
+def _blue_pixel_counts(frame_chunks):
+    """
+    Number of pure blue pixels (B > 200, R < 50, G < 50) in every frame of a video
+    given as consecutive (t, M, N, 3) chunks (see _video_frame_chunks).
+    """
+    counts = []
+    for chunk in frame_chunks:
+        blue = chunk[..., 2] > 200
+        blue &= chunk[..., 0] < 50
+        blue &= chunk[..., 1] < 50
+        counts.append(np.count_nonzero(blue, axis=(1, 2)))
+    return np.concatenate(counts) if counts else np.empty(0, dtype=np.int64)
+
+
+def _true_runs(mask):
+    """Start index and length of every run of consecutive True values in a 1-D boolean array."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    return starts, np.flatnonzero(edges == -1) - starts
+
+
+def _occlusion_from_video(npz_path, blue_pixel_threshold):
+    """
+    Occlusion analysis of one trial's high_res_obs.npz (runs in a worker process).
+    Returns (num_frames, occluded frame indices, lengths of consecutive occluded runs).
+    """
+    counts = _blue_pixel_counts(_video_frame_chunks(npz_path))
+    occluded = counts < blue_pixel_threshold  # Few blue pixels: ball occluded/occluding
+    _, run_lengths = _true_runs(occluded)
+    return len(counts), np.flatnonzero(occluded).tolist(), run_lengths.tolist()
 
 
-def extract_occlusion_data(path_to_data, participant_FPS=15):
+def extract_occlusion_data(path_to_data, participant_FPS=15, blue_pixel_threshold=1900, n_jobs=None):
+    """
+    Measure when the ball is occluded in every trial from its rendered video
+    (trial folder/high_res_obs.npz): a frame counts as occluded when it has fewer than
+    blue_pixel_threshold pure blue pixels. Trials are analyzed in parallel by n_jobs
+    worker processes (None = one per CPU, 1 = no worker processes). Videos are
+    streamed out of the .npz 64 frames at a time, so each worker holds one chunk
+    of frames rather than a whole decompressed video.
+
+    Returns:
+        tuple: (occlusion_durations, occlusion_frames, continuous_occlusion_periods,
+        all_periods_seconds), dicts keyed by trial folder name. The first three only
+        contain trials with at least one occluded frame; durations are in seconds.
+    """
     # Initialize dictionaries to store results
     occlusion_durations = {}
     occlusion_frames = {}
     continuous_occlusion_periods = {}
     all_periods_seconds = {}
 
-    # Loop through each folder in the directory
-    for trial_name in tqdm(sorted(os.listdir(path_to_data))):
-        trial_path = os.path.join(path_to_data, trial_name)
-        if os.path.isdir(trial_path):
-            npz_path = os.path.join(trial_path, "high_res_obs.npz")
-            if os.path.exists(npz_path):
-                # print(f"Processing trial: {trial_name}")
-                # Load the video data
-                video_data = np.load(npz_path)["arr_0"]  # Replace "arr_0" if array name differs
-                T, M, N, _ = video_data.shape
-                all_periods_seconds[trial_name] = T/participant_FPS
-
-                num_blue_pixels = [
-                    np.sum(np.logical_and(np.logical_and(video_data[t,...,2]>200 , video_data[t,...,0]<50), video_data[t,...,1]<50)) for t in range(T)
-                ]
-
-                # Find occluded/occluding frames
-                occluded_frames = [
-                    t for t in range(T) 
-                    if num_blue_pixels[t] < 1900  # Threshold for occluding
-                ]
-                
-                # Calculate duration of occlusion in seconds
-                duration = len(occluded_frames) / participant_FPS  # 30 FPS
-                
-                # Store results
-                if occluded_frames:  # Only store if occlusion is present
-                    occlusion_durations[trial_name] = duration
-                    occlusion_frames[trial_name] = occluded_frames
-                    continuous_periods = []
-                    current_period = [occluded_frames[0]]
-
-                    for i in range(1, len(occluded_frames)):
-                        if occluded_frames[i] == occluded_frames[i-1] + 1:  # Consecutive frame
-                            current_period.append(occluded_frames[i])
-                        else:
-                            # Save the completed period and start a new one
-                            continuous_periods.append(len(current_period))
-                            current_period = [occluded_frames[i]]
-
-                    # Add the last period
-                    continuous_periods.append(len(current_period))
-
-                    # Convert to duration in seconds
-                    continuous_occlusion_periods[trial_name] = [period / participant_FPS for period in continuous_periods]
+    trial_names = [
+        trial_name for trial_name in sorted(os.listdir(path_to_data))
+        if os.path.exists(os.path.join(path_to_data, trial_name, "high_res_obs.npz"))
+    ]
+    npz_paths = [os.path.join(path_to_data, trial_name, "high_res_obs.npz") for trial_name in trial_names]
+    thresholds = [blue_pixel_threshold] * len(npz_paths)
+    if n_jobs == 1:
+        results = list(tqdm(map(_occlusion_from_video, npz_paths, thresholds), total=len(npz_paths)))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(tqdm(executor.map(_occlusion_from_video, npz_paths, thresholds), total=len(npz_paths)))
+
+    for trial_name, (T, occluded_frames, run_lengths) in zip(trial_names, results):
+        all_periods_seconds[trial_name] = T/participant_FPS
+        # Store results
+        if occluded_frames:  # Only store if occlusion is present
+            occlusion_durations[trial_name] = len(occluded_frames) / participant_FPS
+            occlusion_frames[trial_name] = occluded_frames
+            # Convert to duration in seconds
+            continuous_occlusion_periods[trial_name] = [period / participant_FPS for period in run_lengths]
 
 
+    _print_occlusion_summary(occlusion_durations, continuous_occlusion_periods, all_periods_seconds)
+    return occlusion_durations, occlusion_frames, continuous_occlusion_periods, all_periods_seconds
+
+
+def extract_occlusion_data_from_geometry(path_to_data, participant_FPS=None,
+                                         max_visible_fraction=FULLY_VISIBLE_FRACTION):
+    """
+    Same results as extract_occlusion_data, computed from each trial's geometry
+    (ball trajectory, target size and occluder rectangles, see redgreen_occlusion.py)
+    instead of rendered videos, so no high_res_obs.npz is needed. A frame counts as
+    occluded when less than max_visible_fraction of the ball is visible (default: any
+    part hidden). Frame indices are trajectory frames, i.e. the same frame numbers as
+    the keystate data.
+
+    Durations use participant_FPS, or each trial's own playback fps if None.
+    """
+    occlusion_durations = {}
+    occlusion_frames = {}
+    continuous_occlusion_periods = {}
+    all_periods_seconds = {}
+
+    for trial_name, occlusion in dataset_occlusion(path_to_data).items():
+        fps = participant_FPS or occlusion.fps
+        all_periods_seconds[trial_name] = len(occlusion.frames) / fps
+        run_starts, run_lengths = occluded_runs(occlusion.visible_fraction, max_visible_fraction)
+        if len(run_starts):
+            occluded = occlusion.visible_fraction < max_visible_fraction
+            occlusion_durations[trial_name] = int(occluded.sum()) / fps
+            occlusion_frames[trial_name] = occlusion.frames[occluded].tolist()
+            continuous_occlusion_periods[trial_name] = [period / fps for period in run_lengths.tolist()]
+
+    _print_occlusion_summary(occlusion_durations, continuous_occlusion_periods, all_periods_seconds)
+    return occlusion_durations, occlusion_frames, continuous_occlusion_periods, all_periods_seconds
+
+
+def _print_occlusion_summary(occlusion_durations, continuous_occlusion_periods, all_periods_seconds):
     # Calculate summary statistics for occlusion durations (scenes with occlusion)
     if occlusion_durations:
         durations = list(occlusion_durations.values())
@@ -675,5 +1364,3 @@ def extract_occlusion_data(path_to_data, participant_FPS=15):
         print("\nSummary Statistics of All Periods:")
         for stat, value in continuous_summary_stats.items():
             print(f"{stat}: {value:.2f}")
-    return occlusion_durations, occlusion_frames, continuous_occlusion_periods, all_periods_seconds
-
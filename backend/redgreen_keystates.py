@@ -0,0 +1,109 @@
+"""
+Run-length encoding for Red-Green keystate timelines.
+
+Participants typically hold F or J for hundreds of consecutive frames, so a
+trial's per-frame key states compress very well into runs of identical
+(f_pressed, j_pressed) over consecutive frames. This module has no Flask or
+database dependencies so that both the experiment server
+(run_redgreen_experiment.py) and the analysis code
+(postprocess_redgreen_human_data.py) can share one encoder/decoder.
+
+A run is a dict with:
+- start_frame / end_frame: inclusive frame range covered by the run
+- f_pressed / j_pressed: key state held for every frame in the run
+- relative_time_ms: little-endian float64 array (bytes) with one timestamp per
+  frame of the run (NaN for missing), or None if no frame had a timestamp
+
+Decoding a trial's runs in order reproduces the exact per-frame sequence
+(frame, f_pressed, j_pressed, relative_time_ms) that was encoded.
+"""
+
+import math
+import struct
+from collections import namedtuple
+
+# Per-frame view shared by the row-per-frame and run-length storage modes
+DecodedKeyState = namedtuple(
+    "DecodedKeyState",
+    ["trial_id", "session_id", "frame", "f_pressed", "j_pressed", "relative_time_ms"],
+)
+
+
+def pack_relative_times(times):
+    """Pack per-frame relative times (ms, None allowed) as little-endian float64 bytes."""
+    if all(t is None for t in times):
+        return None
+    return struct.pack(f"<{len(times)}d", *(math.nan if t is None else t for t in times))
+
+
+def unpack_relative_times(blob, num_frames):
+    """Inverse of pack_relative_times; returns a list of floats/None of length num_frames."""
+    if blob is None:
+        return [None] * num_frames
+    values = struct.unpack(f"<{num_frames}d", blob)
+    return [None if math.isnan(v) else v for v in values]
+
+
+def encode_keystate_runs(frames):
+    """
+    Encode per-frame key states into runs.
+
+    Args:
+        frames: iterable of (frame, f_pressed, j_pressed, relative_time_ms)
+            tuples in recorded order.
+
+    Returns:
+        list of run dicts (see module docstring). A new run starts whenever
+        the key state changes or the frame number is not the previous
+        frame + 1, so gaps and out-of-order/duplicate frames survive a
+        round trip.
+    """
+    runs = []
+    current = None
+    times = []
+    for frame, f_pressed, j_pressed, relative_time_ms in frames:
+        f_pressed = bool(f_pressed)
+        j_pressed = bool(j_pressed)
+        if (current is not None
+                and frame == current["end_frame"] + 1
+                and f_pressed == current["f_pressed"]
+                and j_pressed == current["j_pressed"]):
+            current["end_frame"] = frame
+            times.append(relative_time_ms)
+            continue
+        if current is not None:
+            current["relative_time_ms"] = pack_relative_times(times)
+            runs.append(current)
+        current = {
+            "start_frame": frame,
+            "end_frame": frame,
+            "f_pressed": f_pressed,
+            "j_pressed": j_pressed,
+        }
+        times = [relative_time_ms]
+    if current is not None:
+        current["relative_time_ms"] = pack_relative_times(times)
+        runs.append(current)
+    return runs
+
+
+def decode_keystate_run(trial_id, session_id, start_frame, end_frame, f_pressed, j_pressed, relative_time_ms=None):
+    """Expand a single run into DecodedKeyState records, one per frame."""
+    num_frames = end_frame - start_frame + 1
+    times = unpack_relative_times(relative_time_ms, num_frames)
+    f_pressed = bool(f_pressed)
+    j_pressed = bool(j_pressed)
+    for offset in range(num_frames):
+        yield DecodedKeyState(trial_id, session_id, start_frame + offset, f_pressed, j_pressed, times[offset])
+
+
+def decode_keystate_runs(runs):
+    """
+    Expand stored runs (objects with KeyStateRun attributes, e.g. ORM rows)
+    into per-frame DecodedKeyState records, preserving run order.
+    """
+    for run in runs:
+        yield from decode_keystate_run(
+            run.trial_id, run.session_id, run.start_frame, run.end_frame,
+            run.f_pressed, run.j_pressed, run.relative_time_ms,
+        )
@@ -0,0 +1,201 @@
+"""
+Analytic ball occlusion for Red-Green trials.
+
+The browser draws the ball (a disc of radius target.size / 2 whose bounding box
+has its bottom-left corner at step_data[frame]) and then paints the gray
+occluder rectangles over it, so the visible part of the ball on a frame is the
+disc minus the union of the occluders. This module computes that visible
+fraction exactly from the trial geometry, for every frame at once:
+
+- the union of a trial's occluders is split into disjoint axis-aligned cells
+  (coordinate compression over the rectangle edges), so overlapping occluders
+  are not counted twice;
+- the area of the disc inside each cell has a closed form (integrals of the
+  circle's chord length, see _area_below), evaluated with NumPy broadcasting
+  over (frames x cells).
+
+It replaces scanning rendered videos (high_res_obs.npz) for blue pixels. The
+input is a parsed trial dict (compile_redgreen_dataset.parse_trial_data, the
+dataset bundle or a symmetry_variants_of_trial / apply_symmetry_transform_to_trial
+variant): D4 transforms move the ball and the occluders together, so a trial
+and all its variants have the same visible fractions up to float rounding.
+dataset_occlusion computes every trial of a dataset folder once per process
+and caches the result until the folder's files change.
+
+Usage (prints per-trial occlusion summaries):
+    python redgreen_occlusion.py trial_data/CandidateTrials_Mar04
+"""
+
+import json
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from compile_redgreen_dataset import dataset_fingerprint, bundle_path_for_dataset, load_dataset_bundle, parse_trial_data
+
+# Frames whose visible fraction is below this count as occluded (any part of the ball hidden)
+FULLY_VISIBLE_FRACTION = 1 - 1e-9
+
+# Per-trial result: trajectory frame numbers, visible fraction per frame, playback frame rate
+TrialOcclusion = namedtuple("TrialOcclusion", ["frames", "visible_fraction", "fps"])
+
+
+def _chord_integral(x, radius):
+    """Integral of the half-chord sqrt(r^2 - t^2) from 0 to x, for x clamped to [-r, r]."""
+    x = np.clip(x, -radius, radius)
+    return 0.5 * (x * np.sqrt(np.maximum(radius * radius - x * x, 0.0)) + radius * radius * np.arcsin(x / radius))
+
+
+def _area_below(x0, x1, y, radius):
+    """
+    Area of the disc of the given radius centered at the origin inside the
+    strip x0 <= X <= x1 (x0 <= x1) and below the line Y = y.
+
+    Over the strip, the disc's vertical extent at X is [-s, s] with
+    s = sqrt(r^2 - X^2), so the area is the integral of clip(y, -s, s) + s.
+    Where |X| < w = sqrt(r^2 - y^2) the clip is y; elsewhere it is sign(y) * s.
+    """
+    full = _chord_integral(x1, radius) - _chord_integral(x0, radius)
+    half_width = np.sqrt(np.maximum(radius * radius - y * y, 0.0))
+    inner_x0 = np.clip(x0, -half_width, half_width)
+    inner_x1 = np.clip(x1, -half_width, half_width)
+    inner = _chord_integral(inner_x1, radius) - _chord_integral(inner_x0, radius)
+    return y * (inner_x1 - inner_x0) + np.sign(y) * (full - inner) + full
+
+
+def disc_rect_overlap(cx, cy, radius, x0, y0, x1, y1):
+    """
+    Area of the disc (cx, cy, radius) inside the rectangle [x0, x1] x [y0, y1].
+    All coordinate arguments broadcast against each other.
+    """
+    dx0 = np.asarray(x0, dtype=np.float64) - cx
+    dx1 = np.asarray(x1, dtype=np.float64) - cx
+    return (_area_below(dx0, dx1, np.asarray(y1, dtype=np.float64) - cy, radius)
+            - _area_below(dx0, dx1, np.asarray(y0, dtype=np.float64) - cy, radius))
+
+
+def _union_cells(occluders):
+    """
+    Split the union of the occluder rectangles into disjoint cells.
+    Returns four (n,) arrays x0, y0, x1, y1.
+    """
+    rects = np.array([
+        [rect.get("x", 0.0), rect.get("y", 0.0), rect.get("width", 0.0), rect.get("height", 0.0)]
+        for rect in occluders if rect.get("width", 0.0) > 0 and rect.get("height", 0.0) > 0
+    ], dtype=np.float64).reshape(-1, 4)
+    left, bottom = rects[:, 0], rects[:, 1]
+    right, top = left + rects[:, 2], bottom + rects[:, 3]
+    xs = np.unique(np.concatenate([left, right]))
+    ys = np.unique(np.concatenate([bottom, top]))
+    if len(xs) < 2 or len(ys) < 2:
+        empty = np.empty(0)
+        return empty, empty, empty, empty
+
+    # A cell between consecutive edges is in the union iff its center is inside some rectangle
+    mid_x = ((xs[:-1] + xs[1:]) / 2)[:, None, None]
+    mid_y = ((ys[:-1] + ys[1:]) / 2)[None, :, None]
+    covered = ((left < mid_x) & (mid_x < right) & (bottom < mid_y) & (mid_y < top)).any(axis=2)
+    ix, iy = np.nonzero(covered)
+    return xs[ix], ys[iy], xs[ix + 1], ys[iy + 1]
+
+
+def ball_visible_fraction(trajectory, radius, occluders):
+    """
+    Fraction (0..1) of the ball visible on every frame of a Trajectory
+    (bottom-left corners of the ball's bounding box) given the occluder
+    rectangles (dicts with x, y, width, height; bottom-left corners).
+    A ball of radius 0 is a point: visible (1) or hidden (0).
+    """
+    centers_x = np.asarray(trajectory.x, dtype=np.float64) + radius
+    centers_y = np.asarray(trajectory.y, dtype=np.float64) + radius
+    x0, y0, x1, y1 = _union_cells(occluders)
+    if len(x0) == 0:
+        return np.ones(len(centers_x))
+    if radius <= 0:
+        hidden = ((x0 <= centers_x[:, None]) & (centers_x[:, None] <= x1)
+                  & (y0 <= centers_y[:, None]) & (centers_y[:, None] <= y1)).any(axis=1)
+        return np.where(hidden, 0.0, 1.0)
+
+    # Only cells that come within one radius of the ball's path can overlap it
+    near = ((x1 > centers_x.min() - radius) & (x0 < centers_x.max() + radius)
+            & (y1 > centers_y.min() - radius) & (y0 < centers_y.max() + radius))
+    x0, y0, x1, y1 = x0[near], y0[near], x1[near], y1[near]
+    hidden_area = disc_rect_overlap(centers_x[:, None], centers_y[:, None], radius, x0, y0, x1, y1).sum(axis=1)
+    return np.clip(1.0 - hidden_area / (np.pi * radius * radius), 0.0, 1.0)
+
+
+def trial_occlusion(trial_dict):
+    """TrialOcclusion of a parsed trial dict."""
+    trajectory = trial_dict["step_data"]
+    return TrialOcclusion(
+        frames=np.asarray(trajectory.frames),
+        visible_fraction=ball_visible_fraction(trajectory, trial_dict.get("radius", 0), trial_dict.get("occluders", [])),
+        fps=trial_dict.get("fps", 30),
+    )
+
+
+def occluded_runs(visible_fraction, max_visible_fraction=FULLY_VISIBLE_FRACTION):
+    """
+    Start positions and lengths (in frames) of the runs of consecutive frames
+    whose visible fraction is below max_visible_fraction.
+    """
+    occluded = np.asarray(visible_fraction) < max_visible_fraction
+    edges = np.diff(np.concatenate(([0], occluded.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    return starts, np.flatnonzero(edges == -1) - starts
+
+
+# Per-process cache: absolute dataset path -> (fingerprint, {trial folder name: TrialOcclusion})
+_DATASET_OCCLUSION_CACHE = {}
+
+
+def _load_dataset_trials(absolute_directory_path, fingerprint):
+    """Parsed trial dicts of a dataset folder, from its compiled bundle when that is up to date."""
+    bundle_path = bundle_path_for_dataset(absolute_directory_path)
+    if os.path.exists(bundle_path):
+        try:
+            bundle = load_dataset_bundle(bundle_path)
+            if bundle["index"]["source_fingerprint"] == fingerprint:
+                return bundle["trials"]
+        except (OSError, ValueError, KeyError):
+            pass
+    trials = {}
+    for entry in sorted(os.listdir(absolute_directory_path)):
+        sim_path = os.path.join(absolute_directory_path, entry, "simulation_data.json")
+        if os.path.exists(sim_path):
+            with open(sim_path, "r") as f:
+                trials[entry] = parse_trial_data(json.load(f))
+    return trials
+
+
+def dataset_occlusion(dataset_dir):
+    """
+    TrialOcclusion of every trial folder in a dataset, keyed by folder name.
+
+    Computed once per process and reused until any simulation_data.json in
+    the folder changes (same fingerprint as the server's dataset cache). The
+    returned arrays are shared between callers and must not be modified.
+    """
+    absolute_directory_path = os.path.abspath(dataset_dir)
+    fingerprint = dataset_fingerprint(absolute_directory_path)
+    cached = _DATASET_OCCLUSION_CACHE.get(absolute_directory_path)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    occlusion = {}
+    for name, trial_dict in _load_dataset_trials(absolute_directory_path, fingerprint).items():
+        occlusion[name] = trial_occlusion(trial_dict)
+        occlusion[name].visible_fraction.flags.writeable = False
+    _DATASET_OCCLUSION_CACHE[absolute_directory_path] = (fingerprint, occlusion)
+    return occlusion
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        raise SystemExit("Usage: python redgreen_occlusion.py <dataset folder>")
+    for name, occlusion in dataset_occlusion(sys.argv[1]).items():
+        starts, lengths = occluded_runs(occlusion.visible_fraction)
+        print(f"{name}: {len(occlusion.frames)} frames, {int(lengths.sum())} occluded in {len(starts)} runs, "
+              f"min visible fraction {occlusion.visible_fraction.min():.3f}")
@@ -0,0 +1,195 @@
+"""
+Vectorized scoring for Red-Green trials.
+
+A trial's score rewards every frame on which the participant held only the key
+for the correct outcome and penalizes every frame on which they held only the
+other key:
+
+    score = 20 + 100 * (correct_frames / num_frames - incorrect_frames / num_frames)
+
+which ranges from -80 to 120. F means red and J means green once the server
+has undone counterbalancing (i.e. the key states as stored in the keystate
+tables). Trials whose rg_outcome is neither 'red' nor 'green' score 0. Besides
+this score (the one /save_data shows participants) the module computes:
+
+- time-weighted scores: each frame counts in proportion to how long it was on
+  screen (see frame_durations_ms), so frames the browser held longer weigh more
+- windowed scores: only frames inside a window count, e.g. the frames during
+  which the ball is occluded (extract_occlusion_data's occlusion_frames)
+- per-frame cumulative score timelines, whose last value is the trial score
+
+Every function works on flat per-frame NumPy arrays. The batch functions take a
+per-frame trial index (0..num_trials-1) and score any number of trials with a
+handful of bincount/cumsum passes, which is how
+postprocess_redgreen_human_data.rescore_database rescores a whole database.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+SCORE_BASE = 20
+SCORE_RANGE = 100
+
+# Response code of the correct key for each outcome (see response_codes)
+OUTCOME_SIGNS = {"red": 1, "green": -1}
+
+KeyStateArrays = namedtuple("KeyStateArrays", ["frames", "f_pressed", "j_pressed"])
+
+
+def keystate_arrays(recorded_key_states, counterbalance=False):
+    """
+    Convert /save_data's recordedKeyStates ([{'frame': .., 'keys': {'f': .., 'j': ..}}, ...])
+    into KeyStateArrays. With counterbalance, F/J are swapped back to physical
+    red/green, exactly as they are stored.
+    """
+    num_frames = len(recorded_key_states)
+    frames = np.fromiter((entry["frame"] for entry in recorded_key_states), dtype=np.int64, count=num_frames)
+    f_pressed = np.fromiter((bool(entry["keys"]["f"]) for entry in recorded_key_states), dtype=bool, count=num_frames)
+    j_pressed = np.fromiter((bool(entry["keys"]["j"]) for entry in recorded_key_states), dtype=bool, count=num_frames)
+    if counterbalance:
+        f_pressed, j_pressed = j_pressed, f_pressed
+    return KeyStateArrays(frames, f_pressed, j_pressed)
+
+
+def outcome_sign(rg_outcome):
+    """OUTCOME_SIGNS value for an rg_outcome string (0 for anything but 'red'/'green')."""
+    return OUTCOME_SIGNS.get(rg_outcome, 0)
+
+
+def response_codes(f_pressed, j_pressed):
+    """Per-frame response as int8: 1 = only F (red), -1 = only J (green), 0 = neither or both."""
+    f_pressed = np.asarray(f_pressed, dtype=bool)
+    j_pressed = np.asarray(j_pressed, dtype=bool)
+    return (f_pressed & ~j_pressed).astype(np.int8) - (j_pressed & ~f_pressed).astype(np.int8)
+
+
+def frame_durations_ms(relative_time_ms, group_index=None):
+    """
+    How long each frame was on screen: the time until the next frame of the
+    same trial, for use as time-weighted scoring weights.
+
+    Each trial's last frame, and frames whose timestamp is missing (NaN) or not
+    increasing, get the median duration of that trial's other frames. Trials
+    without any usable timestamps get weight 1 for every frame, which reduces
+    the time-weighted score to the plain one. Rows must be grouped by trial
+    (group_index, see score_trials; None means a single trial) and sorted by
+    frame within each trial.
+    """
+    times = np.asarray(relative_time_ms, dtype=np.float64)
+    group_index = np.zeros(len(times), dtype=np.intp) if group_index is None else np.asarray(group_index, dtype=np.intp)
+    durations = np.full(len(times), np.nan)
+    if len(times) > 1:
+        same_trial = group_index[1:] == group_index[:-1]
+        durations[:-1] = np.where(same_trial, times[1:] - times[:-1], np.nan)
+    with np.errstate(invalid="ignore"):
+        durations[~(durations > 0)] = np.nan
+
+    # Per-trial median of the usable durations: sort by (trial, duration) and take the middle
+    valid = ~np.isnan(durations)
+    valid_groups = group_index[valid]
+    valid_durations = durations[valid]
+    order = np.lexsort((valid_durations, valid_groups))
+    valid_groups = valid_groups[order]
+    valid_durations = valid_durations[order]
+    num_groups = int(group_index.max()) + 1 if len(group_index) else 0
+    counts = np.bincount(valid_groups, minlength=num_groups)
+    starts = np.cumsum(counts) - counts
+    medians = np.ones(num_groups)
+    has_durations = counts > 0
+    lower = valid_durations[(starts + (counts - 1) // 2)[has_durations]]
+    upper = valid_durations[(starts + counts // 2)[has_durations]]
+    medians[has_durations] = (lower + upper) / 2
+
+    missing = np.isnan(durations)
+    durations[missing] = medians[group_index[missing]]
+    return durations
+
+
+def _frame_outcomes(group_index, f_pressed, j_pressed, outcome_signs, weights, window):
+    """Per-frame weights of correct and incorrect responses, plus per-frame total weight."""
+    correctness = response_codes(f_pressed, j_pressed) * np.asarray(outcome_signs, dtype=np.int8)[group_index]
+    frame_weights = np.ones(len(correctness)) if weights is None else np.asarray(weights, dtype=np.float64)
+    if window is not None:
+        frame_weights = np.where(window, frame_weights, 0.0)
+    return frame_weights * (correctness > 0), frame_weights * (correctness < 0), frame_weights
+
+
+def _combine(correct, incorrect, total):
+    # Same operation order as the original per-trial formula, so plain scores match it bit for bit
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return SCORE_BASE + SCORE_RANGE * ((correct / total) - (incorrect / total))
+
+
+def score_trials(group_index, f_pressed, j_pressed, outcome_signs, weights=None, window=None):
+    """
+    Score many trials at once.
+
+    Args:
+        group_index: per-frame trial index in 0..len(outcome_signs)-1
+        f_pressed, j_pressed: per-frame key states as stored (after counterbalancing)
+        outcome_signs: per-trial outcome_sign of the trial's rg_outcome
+        weights: optional per-frame weights (e.g. frame_durations_ms) for a
+            time-weighted score; None counts every frame once
+        window: optional per-frame boolean mask; frames outside it are ignored
+
+    Returns:
+        np.ndarray: one float64 score per trial. Trials with an unknown
+        outcome score 0; trials without frames (inside the window) score NaN.
+    """
+    group_index = np.asarray(group_index, dtype=np.intp)
+    outcome_signs = np.asarray(outcome_signs)
+    num_trials = len(outcome_signs)
+    correct, incorrect, frame_weights = _frame_outcomes(group_index, f_pressed, j_pressed, outcome_signs, weights, window)
+    total = np.bincount(group_index, weights=frame_weights, minlength=num_trials)
+    scores = _combine(
+        np.bincount(group_index, weights=correct, minlength=num_trials),
+        np.bincount(group_index, weights=incorrect, minlength=num_trials),
+        total,
+    )
+    scores[outcome_signs == 0] = 0.0
+    scores[total == 0] = np.nan
+    return scores
+
+
+def cumulative_scores(group_index, f_pressed, j_pressed, outcome_signs, weights=None, window=None):
+    """
+    Per-frame cumulative score timelines for many trials at once (same
+    arguments as score_trials).
+
+    The value at a frame is the trial score counting only the responses up to
+    and including that frame, normalized by the whole trial's frame count (or
+    weight), so each timeline starts near 20 and ends at the trial score
+    (exactly for plain scores, up to float rounding for weighted ones). Rows
+    must be grouped by trial and sorted by frame within each trial.
+    """
+    group_index = np.asarray(group_index, dtype=np.intp)
+    outcome_signs = np.asarray(outcome_signs)
+    correct, incorrect, frame_weights = _frame_outcomes(group_index, f_pressed, j_pressed, outcome_signs, weights, window)
+    total = np.bincount(group_index, weights=frame_weights, minlength=len(outcome_signs))[group_index]
+    timelines = _combine(_grouped_cumsum(correct, group_index), _grouped_cumsum(incorrect, group_index), total)
+    timelines[outcome_signs[group_index] == 0] = 0.0
+    timelines[total == 0] = np.nan
+    return timelines
+
+
+def _grouped_cumsum(values, group_index):
+    """Cumulative sum of values restarting at every change of group_index."""
+    totals = np.cumsum(values)
+    if len(values) == 0:
+        return totals
+    starts = np.flatnonzero(np.r_[True, group_index[1:] != group_index[:-1]])
+    offsets = np.r_[0.0, totals[starts[1:] - 1]]
+    return totals - np.repeat(offsets, np.diff(np.r_[starts, len(values)]))
+
+
+def trial_score(f_pressed, j_pressed, rg_outcome, weights=None, window=None):
+    """Score of a single trial (see score_trials); this is the score /save_data reports."""
+    group_index = np.zeros(len(f_pressed), dtype=np.intp)
+    return float(score_trials(group_index, f_pressed, j_pressed, [outcome_sign(rg_outcome)], weights, window)[0])
+
+
+def score_timeline(f_pressed, j_pressed, rg_outcome, weights=None, window=None):
+    """Per-frame cumulative score timeline of a single trial (see cumulative_scores)."""
+    group_index = np.zeros(len(f_pressed), dtype=np.intp)
+    return cumulative_scores(group_index, f_pressed, j_pressed, [outcome_sign(rg_outcome)], weights, window)
@@ -0,0 +1,353 @@
+"""
+D4 symmetry transforms for Red-Green trial scenes.
+
+Each of the 8 D4 transforms maps a square world onto itself around its center
+(rotations by multiples of 90 degrees and the four reflections); see
+_get_d4_matrix for the index -> transform mapping used by the experiment and
+stored in trial.symmetry_transform.
+
+Two implementations live here:
+- the scalar reference functions (transform_point, transform_rect_bottom_left,
+  transform_ball_bottom_left), one point or rectangle at a time;
+- a NumPy engine (symmetry_variants_of_trial) that transforms a whole trial,
+  i.e. every barrier, occluder and sensor plus the ball trajectory, for any
+  number of transforms in one batched pass over (transforms x objects) arrays.
+
+The engine performs the same floating-point operations in the same order as
+the scalar functions, so its output is bit-for-bit identical (checked by the
+benchmark below).
+
+Benchmark (scalar reference vs. NumPy engine on a trial dataset):
+    python redgreen_symmetry.py trial_data/cogsci_2025_trials
+"""
+
+import numpy as np
+
+from redgreen_trajectories import Trajectory
+
+NUM_D4_TRANSFORMS = 8
+
+# Geometry keys of a parsed trial that hold axis-aligned rectangles
+RECT_LIST_KEYS = ("barriers", "occluders")
+RECT_SINGLE_KEYS = ("red_sensor", "green_sensor")
+
+
+def _get_d4_matrix(transform_index):
+    """
+    Return (a, b, c, d, swaps_axes) for the given D4 transform index.
+    The mapping is:
+      0: Identity
+      1: Rotation 90 degrees CCW
+      2: Rotation 180 degrees
+      3: Rotation 270 degrees CCW
+      4: Reflection across the vertical axis
+      5: Reflection across the horizontal axis
+      6: Reflection across the main diagonal
+      7: Reflection across the anti-diagonal
+    """
+    if transform_index == 0:
+        return 1, 0, 0, 1, False
+    elif transform_index == 1:
+        # x' = cx - (y - cy), y' = cy + (x - cx)
+        return 0, -1, 1, 0, True
+    elif transform_index == 2:
+        # x' = 2cx - x, y' = 2cy - y
+        return -1, 0, 0, -1, False
+    elif transform_index == 3:
+        # x' = cx + (y - cy), y' = cy - (x - cx)
+        return 0, 1, -1, 0, True
+    elif transform_index == 4:
+        # x' = 2cx - x, y' = y
+        return -1, 0, 0, 1, False
+    elif transform_index == 5:
+        # x' = x, y' = 2cy - y
+        return 1, 0, 0, -1, False
+    elif transform_index == 6:
+        # x' = cx + (y - cy), y' = cy + (x - cx)
+        return 0, 1, 1, 0, True
+    elif transform_index == 7:
+        # x' = cx - (y - cy), y' = cy - (x - cx)
+        return 0, -1, -1, 0, True
+    else:
+        raise ValueError(f"Invalid D4 transform index: {transform_index}")
+
+
+# Lookup tables for the NumPy engine: row i holds _get_d4_matrix(i)
+D4_MATRICES = np.array([_get_d4_matrix(i)[:4] for i in range(NUM_D4_TRANSFORMS)], dtype=np.float64)
+D4_SWAPS_AXES = np.array([_get_d4_matrix(i)[4] for i in range(NUM_D4_TRANSFORMS)], dtype=bool)
+
+
+def transform_point(x, y, W, H, transform_index):
+    """Apply the specified D4 symmetry transform to a point (x, y)."""
+    cx = W / 2.0
+    cy = H / 2.0
+    a, b, c, d, _ = _get_d4_matrix(transform_index)
+    dx = x - cx
+    dy = y - cy
+    x_prime = cx + a * dx + b * dy
+    y_prime = cy + c * dx + d * dy
+    return x_prime, y_prime
+
+
+def transform_rect_bottom_left(x, y, width, height, W, H, transform_index):
+    """
+    Transform an axis-aligned rectangle specified by its bottom-left corner
+    and dimensions. The rectangle is represented internally by its center,
+    transformed via the D4 symmetry, and then reconstructed. For transforms
+    that swap axes, width/height are swapped.
+    """
+    cx_rect = x + width / 2.0
+    cy_rect = y + height / 2.0
+    a, b, c, d, swaps_axes = _get_d4_matrix(transform_index)
+    cx_world = W / 2.0
+    cy_world = H / 2.0
+    dx = cx_rect - cx_world
+    dy = cy_rect - cy_world
+    cx_prime = cx_world + a * dx + b * dy
+    cy_prime = cy_world + c * dx + d * dy
+
+    if swaps_axes:
+        width, height = height, width
+
+    new_x = cx_prime - width / 2.0
+    new_y = cy_prime - height / 2.0
+    return new_x, new_y, width, height
+
+
+def transform_ball_bottom_left(x, y, radius, W, H, transform_index):
+    """
+    Transform the bottom-left of a ball given its radius by transforming
+    the ball center and recomputing the bottom-left.
+    """
+    cx_ball = x + radius
+    cy_ball = y + radius
+    cx_prime, cy_prime = transform_point(cx_ball, cy_ball, W, H, transform_index)
+    return cx_prime - radius, cy_prime - radius
+
+
+def _d4_coefficients(transform_indices):
+    """Per-transform (a, b, c, d) columns of shape (k, 1) and the swaps_axes flags, for broadcasting."""
+    transform_indices = np.asarray(transform_indices, dtype=np.intp)
+    if transform_indices.size and (transform_indices.min() < 0 or transform_indices.max() >= NUM_D4_TRANSFORMS):
+        raise ValueError(f"Invalid D4 transform index in {transform_indices.tolist()}")
+    a, b, c, d = D4_MATRICES[transform_indices].T[:, :, None]
+    return a, b, c, d, D4_SWAPS_AXES[transform_indices]
+
+
+def transform_points(x, y, W, H, transform_indices):
+    """
+    Vectorized transform_point: x and y are arrays of shape (n,), and the
+    result is a pair of (k, n) arrays, row i transformed by transform_indices[i].
+    """
+    a, b, c, d, _ = _d4_coefficients(transform_indices)
+    cx = W / 2.0
+    cy = H / 2.0
+    dx = np.asarray(x, dtype=np.float64) - cx
+    dy = np.asarray(y, dtype=np.float64) - cy
+    return cx + a * dx + b * dy, cy + c * dx + d * dy
+
+
+def transform_rects(x, y, width, height, W, H, transform_indices):
+    """
+    Vectorized transform_rect_bottom_left for n rectangles and k transforms.
+    Returns (new_x, new_y, swaps_axes): (k, n) bottom-left corners and a (k,)
+    bool array telling which transforms swap width and height.
+    """
+    width = np.asarray(width, dtype=np.float64)
+    height = np.asarray(height, dtype=np.float64)
+    _, _, _, _, swaps_axes = _d4_coefficients(transform_indices)
+    cx_prime, cy_prime = transform_points(
+        np.asarray(x, dtype=np.float64) + width / 2.0,
+        np.asarray(y, dtype=np.float64) + height / 2.0,
+        W, H, transform_indices,
+    )
+    new_width = np.where(swaps_axes[:, None], height, width)
+    new_height = np.where(swaps_axes[:, None], width, height)
+    return cx_prime - new_width / 2.0, cy_prime - new_height / 2.0, swaps_axes
+
+
+def transform_trajectory(trajectory, radius, W, H, transform_indices):
+    """Vectorized transform_ball_bottom_left over a whole Trajectory; returns one Trajectory per transform."""
+    x_prime, y_prime = transform_points(trajectory.x + radius, trajectory.y + radius, W, H, transform_indices)
+    return [
+        Trajectory(frames=trajectory.frames, x=x_row - radius, y=y_row - radius)
+        for x_row, y_row in zip(x_prime, y_prime)
+    ]
+
+
+def symmetry_variants_of_trial(trial_dict, transform_indices=range(NUM_D4_TRANSFORMS)):
+    """
+    Transform a parsed trial dict by several D4 transforms at once.
+
+    All rectangles (barriers, occluders, sensors) are gathered into one set of
+    arrays and transformed together with the ball trajectory for every
+    requested transform. trial_dict is not modified; each variant is a new
+    dict that shares the non-geometric fields with it and is annotated with
+    'symmetry_transform'.
+
+    Returns:
+        dict: transform_index -> transformed trial dict, in transform_indices order
+    """
+    transform_indices = [int(transform_index) for transform_index in transform_indices]
+    W = trial_dict.get("worldWidth", 20)
+    H = trial_dict.get("worldHeight", 20)
+    radius = trial_dict.get("radius", 0)
+
+    # (owner key, list position or None, rect dict) for every rectangle in the scene
+    rect_slots = [(key, i, rect) for key in RECT_LIST_KEYS for i, rect in enumerate(trial_dict.get(key, []))]
+    rect_slots += [(key, None, trial_dict[key]) for key in RECT_SINGLE_KEYS if trial_dict.get(key)]
+    rects = [slot[2] for slot in rect_slots]
+    new_x, new_y, swaps_axes = transform_rects(
+        [rect.get("x", 0.0) for rect in rects],
+        [rect.get("y", 0.0) for rect in rects],
+        [rect.get("width", 0.0) for rect in rects],
+        [rect.get("height", 0.0) for rect in rects],
+        W, H, transform_indices,
+    )
+
+    trajectory = trial_dict.get("step_data")
+    trajectories = (
+        transform_trajectory(trajectory, radius, W, H, transform_indices) if trajectory is not None
+        else [None] * len(transform_indices)
+    )
+
+    variants = {}
+    for row, transform_index in enumerate(transform_indices):
+        variant = dict(trial_dict)
+        for key in RECT_LIST_KEYS:
+            variant[key] = list(trial_dict.get(key, []))
+        for (key, i, rect), nx, ny in zip(rect_slots, new_x[row].tolist(), new_y[row].tolist()):
+            # Width/height keep their original Python values (int or float), only swapped
+            width, height = rect.get("width", 0.0), rect.get("height", 0.0)
+            if swaps_axes[row]:
+                width, height = height, width
+            updated = rect.copy()
+            updated.update({"x": nx, "y": ny, "width": width, "height": height})
+            if i is None:
+                variant[key] = updated
+            else:
+                variant[key][i] = updated
+        if trajectories[row] is not None:
+            variant["step_data"] = trajectories[row]
+        variant["symmetry_transform"] = transform_index
+        variants[transform_index] = variant
+    return variants
+
+
+def apply_symmetry_transform_to_trial(trial_dict, transform_index):
+    """
+    Apply the specified D4 symmetry transform to all relevant geometric
+    components of a parsed trial dict (barriers, occluders, sensors, step_data).
+    Mutates trial_dict in place and annotates it with 'symmetry_transform'.
+    """
+    trial_dict.update(symmetry_variants_of_trial(trial_dict, [transform_index])[transform_index])
+
+
+def _apply_symmetry_transform_scalar(trial_dict, transform_index):
+    """Reference implementation: the scalar functions applied rectangle by rectangle and frame by frame."""
+    W = trial_dict.get("worldWidth", 20)
+    H = trial_dict.get("worldHeight", 20)
+    radius = trial_dict.get("radius", 0)
+    variant = dict(trial_dict)
+
+    def _transform_rect(rect):
+        nx, ny, nw, nh = transform_rect_bottom_left(
+            rect.get("x", 0.0), rect.get("y", 0.0), rect.get("width", 0.0), rect.get("height", 0.0),
+            W, H, transform_index,
+        )
+        updated = rect.copy()
+        updated.update({"x": nx, "y": ny, "width": nw, "height": nh})
+        return updated
+
+    for key in RECT_LIST_KEYS:
+        variant[key] = [_transform_rect(rect) for rect in trial_dict.get(key, [])]
+    for key in RECT_SINGLE_KEYS:
+        if trial_dict.get(key):
+            variant[key] = _transform_rect(trial_dict[key])
+
+    trajectory = trial_dict.get("step_data")
+    if trajectory is not None:
+        positions = [
+            transform_ball_bottom_left(x, y, radius, W, H, transform_index)
+            for x, y in zip(trajectory.x.tolist(), trajectory.y.tolist())
+        ]
+        variant["step_data"] = Trajectory(
+            frames=trajectory.frames,
+            x=np.array([x for x, _ in positions], dtype=np.float64),
+            y=np.array([y for _, y in positions], dtype=np.float64),
+        )
+    variant["symmetry_transform"] = transform_index
+    return variant
+
+
+def _variants_equal(expected, actual):
+    """Exact (bit-for-bit) comparison of two transformed trial dicts."""
+    if expected.keys() != actual.keys():
+        return False
+    for key, value in expected.items():
+        if isinstance(value, Trajectory):
+            other = actual[key]
+            if not all(np.array_equal(getattr(value, f).view(np.uint8), getattr(other, f).view(np.uint8))
+                       for f in Trajectory._fields):
+                return False
+        elif repr(value) != repr(actual[key]):
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+    import glob
+    import json
+    import os
+    import time
+
+    from compile_redgreen_dataset import parse_trial_data
+
+    parser = argparse.ArgumentParser(description="Benchmark the scalar and NumPy D4 symmetry transforms.")
+    parser.add_argument("dataset", help="Dataset folder containing <trial>/simulation_data.json files")
+    parser.add_argument("--repeats", type=int, default=5, help="Timing repetitions (best run is reported)")
+    args = parser.parse_args()
+
+    trials = []
+    for path in sorted(glob.glob(os.path.join(args.dataset, "*", "simulation_data.json"))):
+        with open(path) as f:
+            trials.append(parse_trial_data(json.load(f)))
+    if not trials:
+        raise SystemExit(f"No simulation_data.json files found under '{args.dataset}'")
+    num_frames = sum(len(trial["step_data"].frames) for trial in trials)
+    print(f"{len(trials)} trials, {num_frames} trajectory frames, {NUM_D4_TRANSFORMS} transforms each")
+
+    mismatches = 0
+    for trial in trials:
+        batched = symmetry_variants_of_trial(trial)
+        for transform_index in range(NUM_D4_TRANSFORMS):
+            single = dict(trial)
+            apply_symmetry_transform_to_trial(single, transform_index)
+            expected = _apply_symmetry_transform_scalar(trial, transform_index)
+            mismatches += not _variants_equal(expected, batched[transform_index])
+            mismatches += not _variants_equal(expected, single)
+    print(f"Parity with the scalar reference: {'OK' if mismatches == 0 else f'{mismatches} MISMATCHES'}")
+
+    def _best_of(fn):
+        best = float("inf")
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    timings = {
+        "scalar, one transform at a time": _best_of(lambda: [
+            _apply_symmetry_transform_scalar(trial, t) for trial in trials for t in range(NUM_D4_TRANSFORMS)
+        ]),
+        "numpy, one transform at a time": _best_of(lambda: [
+            symmetry_variants_of_trial(trial, [t]) for trial in trials for t in range(NUM_D4_TRANSFORMS)
+        ]),
+        "numpy, all 8 variants batched": _best_of(lambda: [
+            symmetry_variants_of_trial(trial) for trial in trials
+        ]),
+    }
+    baseline = timings["scalar, one transform at a time"]
+    for label, seconds in timings.items():
+        print(f"{label:<34} {seconds * 1000:9.2f} ms  ({baseline / seconds:5.1f}x)")
@@ -0,0 +1,118 @@
+"""
+Array-based ball trajectories for Red-Green trials.
+
+Trial JSON files store the ball path as step_data = {"0": {"x": .., "y": ..}, ...}.
+Keeping that as a Python dict of dicts per frame costs several hundred bytes per
+frame in every worker, so parse_json converts it once into a Trajectory: three
+contiguous NumPy arrays (frame numbers, x, y). Positions stay float64 so that
+the default payload sent to the browser is bit-for-bit what the JSON file held.
+
+Wire encodings for the scene payload (see load_next_scene's trajectory_encoding):
+- 'dict' (default): the original {frame: {"x": .., "y": ..}} object
+- 'float32': base64 little-endian float32 x/y arrays
+- 'quantized_delta': positions rounded to multiples of QUANTIZATION_STEP, sent as
+  base64 little-endian int16 (or int32 if needed) deltas from the previous frame
+
+Compact encodings are JSON objects:
+    {"encoding": ..., "num_frames": N, "x": <base64>, "y": <base64>,
+     "frames": <base64 int32, only if frames are not 0..N-1>,
+     "dtype": "int16"|"int32", "scale": step}   # quantized_delta only
+and decode_trajectory turns any of them back into a Trajectory.
+
+The module has no Flask or database dependencies so that the standalone
+dataset compiler (compile_redgreen_dataset.py) builds the same Trajectory
+objects the experiment server serves.
+"""
+
+import base64
+from collections import namedtuple
+
+import numpy as np
+
+Trajectory = namedtuple("Trajectory", ["frames", "x", "y"])
+
+TRAJECTORY_ENCODINGS = ("dict", "float32", "quantized_delta")
+
+# Quantization step (world units) for 'quantized_delta'; worlds are ~20 units wide,
+# so the error (at most half a step) is far below one screen pixel
+QUANTIZATION_STEP = 1e-3
+
+
+def trajectory_from_step_data(step_data):
+    """Build a Trajectory from a step_data mapping of frame -> {'x': .., 'y': ..} (keys may be str or int)."""
+    items = sorted(((int(frame), position) for frame, position in step_data.items()), key=lambda item: item[0])
+    return Trajectory(
+        frames=np.array([frame for frame, _ in items], dtype=np.int32),
+        x=np.array([position["x"] for _, position in items], dtype=np.float64),
+        y=np.array([position["y"] for _, position in items], dtype=np.float64),
+    )
+
+
+def trajectory_to_step_data(trajectory):
+    """Inverse of trajectory_from_step_data: the original {frame: {'x': .., 'y': ..}} dict."""
+    return {
+        frame: {"x": x, "y": y}
+        for frame, x, y in zip(trajectory.frames.tolist(), trajectory.x.tolist(), trajectory.y.tolist())
+    }
+
+
+def _b64(array, dtype):
+    return base64.b64encode(np.ascontiguousarray(array, dtype=dtype).tobytes()).decode("ascii")
+
+
+def _unb64(text, dtype):
+    return np.frombuffer(base64.b64decode(text), dtype=dtype)
+
+
+def encode_trajectory(trajectory, encoding="dict"):
+    """Encode a Trajectory in one of TRAJECTORY_ENCODINGS for a JSON scene payload."""
+    if encoding == "dict":
+        return trajectory_to_step_data(trajectory)
+    if encoding not in TRAJECTORY_ENCODINGS:
+        raise ValueError(f"Unknown trajectory encoding '{encoding}'. Expected one of {TRAJECTORY_ENCODINGS}")
+
+    num_frames = len(trajectory.frames)
+    payload = {"encoding": encoding, "num_frames": num_frames}
+    if not np.array_equal(trajectory.frames, np.arange(num_frames)):
+        payload["frames"] = _b64(trajectory.frames, "<i4")
+
+    if encoding == "float32":
+        payload["x"] = _b64(trajectory.x, "<f4")
+        payload["y"] = _b64(trajectory.y, "<f4")
+        return payload
+
+    # quantized_delta: first value is relative to 0, so a cumulative sum restores absolute positions
+    deltas = {
+        axis: np.diff(np.rint(values / QUANTIZATION_STEP).astype(np.int64), prepend=0)
+        for axis, values in (("x", trajectory.x), ("y", trajectory.y))
+    }
+    fits_int16 = all(np.abs(d).max(initial=0) <= np.iinfo(np.int16).max for d in deltas.values())
+    dtype = "int16" if fits_int16 else "int32"
+    payload["dtype"] = dtype
+    payload["scale"] = QUANTIZATION_STEP
+    payload["x"] = _b64(deltas["x"], "<i2" if fits_int16 else "<i4")
+    payload["y"] = _b64(deltas["y"], "<i2" if fits_int16 else "<i4")
+    return payload
+
+
+def decode_trajectory(payload):
+    """Decode any encode_trajectory output (including the plain step_data dict) into a Trajectory."""
+    if "encoding" not in payload:
+        return trajectory_from_step_data(payload)
+
+    num_frames = payload["num_frames"]
+    if "frames" in payload:
+        frames = _unb64(payload["frames"], "<i4").astype(np.int32)
+    else:
+        frames = np.arange(num_frames, dtype=np.int32)
+
+    if payload["encoding"] == "float32":
+        x = _unb64(payload["x"], "<f4").astype(np.float64)
+        y = _unb64(payload["y"], "<f4").astype(np.float64)
+    elif payload["encoding"] == "quantized_delta":
+        dtype = "<i2" if payload["dtype"] == "int16" else "<i4"
+        x = np.cumsum(_unb64(payload["x"], dtype).astype(np.int64)) * payload["scale"]
+        y = np.cumsum(_unb64(payload["y"], dtype).astype(np.int64)) * payload["scale"]
+    else:
+        raise ValueError(f"Unknown trajectory encoding '{payload['encoding']}'")
+    return Trajectory(frames=frames, x=x, y=y)
@@ -0,0 +1,268 @@
+"""
+Parity of the vectorized duplicate resolution in postprocess_redgreen_human_data
+(_resolve_duplicate_trials, _resolve_duplicate_keystates) with the groupby().apply
+implementation it replaced: same rows in the same order, and the same ValueError
+message naming the same offending rows.
+
+Trial and keystate frames come from the bundled instance/*.db files, read with
+the same helpers extract_human_data uses (the pre-pilot databases predate
+redgreen_session.ignore_data, so sessions are selected directly), with
+duplicate rows injected on top. A seeded randomized run covers the corner
+cases the recorded data does not (missing names, frames and scores).
+
+Run from the backend folder:
+    python -m pytest tests
+"""
+
+import glob
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from postprocess_redgreen_human_data import (  # noqa: E402
+    _read_keystates, _read_trials, _resolve_duplicate_keystates, _resolve_duplicate_trials,
+)
+
+BUNDLED_DATABASES = sorted(glob.glob(os.path.join(BACKEND_DIR, "instance", "*.db")))
+
+# The reference implementation is kept verbatim, grouping-column apply included
+pytestmark = pytest.mark.filterwarnings("ignore:DataFrameGroupBy.apply operated on the grouping columns")
+
+
+# ---------------------------------------------------------------------------
+# Reference: the groupby().apply implementation from extract_human_data
+# ---------------------------------------------------------------------------
+
+def _reference_resolve_duplicate_trials(trial_df, allowed_repeat_trial_names):
+    dup_mask = trial_df.duplicated(subset=['session_id', 'global_trial_name'], keep=False)
+    if dup_mask.any():
+        dup_rows = trial_df[dup_mask].sort_values(['session_id', 'global_trial_name', 'trial_id'])
+
+        def _resolve_trial_group(g):
+            name = g['global_trial_name'].iloc[0]
+            if name in allowed_repeat_trial_names:
+                def _keep_one_instance(h):
+                    with_score = h[h['score'].notna()]
+                    scores = h['score'].dropna()
+                    if scores.nunique() > 1:
+                        raise ValueError(
+                            "Duplicate trials for the same (session, global_trial_name, repeat_instance_index) "
+                            "have different scores (score discrepancy). This must be resolved manually.\n"
+                            f"Offending rows:\n{h}"
+                        )
+                    if len(with_score) == 1:
+                        return with_score.iloc[[0]]
+                    return h.sort_values('trial_id').iloc[[-1]]
+                return (
+                    g.groupby('repeat_instance_index', as_index=False, group_keys=False)
+                    .apply(_keep_one_instance)
+                )
+            scores = g['score'].astype(float)
+            if scores.nunique() > 1:
+                raise ValueError(
+                    f"Duplicate trials found for global_trial_name={name!r} within a session "
+                    "but with different scores, and this trial is not in repeat.csv. "
+                    "Either add it to repeat.csv if repeats are intended, or resolve manually.\n"
+                    f"Offending rows:\n{g}"
+                )
+            return g.sort_values('trial_id').iloc[[-1]]
+
+        resolved = (
+            dup_rows
+            .groupby(['session_id', 'global_trial_name'], as_index=False, group_keys=False)
+            .apply(_resolve_trial_group)
+        )
+        trial_df = pd.concat([trial_df[~dup_mask], resolved], ignore_index=True)
+    return trial_df
+
+
+def _reference_resolve_duplicate_keystates(keystate_df):
+    dup_keystate_mask = keystate_df.duplicated(subset=['trial_id', 'frame'], keep=False)
+    if dup_keystate_mask.any():
+        dup_rows = keystate_df[dup_keystate_mask].sort_values(['trial_id', 'frame'])
+
+        def _resolve_keystate_group(g):
+            same_f = g['f_pressed'].nunique() == 1
+            same_j = g['j_pressed'].nunique() == 1
+            if same_f and same_j:
+                return g.iloc[[0]]
+            raise ValueError(
+                "Raw keystate data contains conflicting rows for the same trial_id/frame "
+                "with different key states. This must be resolved before exporting.\n"
+                f"Offending rows:\n{g}"
+            )
+
+        resolved_ks = (
+            dup_rows
+            .groupby(['trial_id', 'frame'], as_index=False, group_keys=False)
+            .apply(_resolve_keystate_group)
+        )
+        keystate_df = pd.concat([keystate_df[~dup_keystate_mask], resolved_ks], ignore_index=True)
+    return keystate_df
+
+
+def _outcome(resolve, *args):
+    try:
+        return resolve(*args), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def assert_same_resolution(reference, vectorized, df, *args):
+    """Both implementations return equal frames, or raise ValueError with the same message."""
+    expected, expected_error = _outcome(reference, df.copy(), *args)
+    actual, actual_error = _outcome(vectorized, df.copy(), *args)
+    assert actual_error == expected_error
+    if expected_error is None:
+        pd.testing.assert_frame_equal(actual, expected)
+    return expected_error
+
+
+# ---------------------------------------------------------------------------
+# Bundled databases
+# ---------------------------------------------------------------------------
+
+def _load_frames(db_path):
+    """Completed experimental trials and their keystates, as extract_human_data reads them."""
+    engine = create_engine(f"sqlite:///{db_path}")
+    with engine.connect() as conn:
+        session_df = pd.read_sql(text("SELECT id AS session_id FROM redgreen_session ORDER BY id"), conn)
+        trial_df = _read_trials(conn, session_df)
+        trial_df["repeat_instance_index"] = trial_df["repeat_instance_index"].fillna(0).astype(int)
+        keystate_df = _read_keystates(conn, trial_df["trial_id"].tolist())
+    engine.dispose()
+    return trial_df, keystate_df
+
+
+@pytest.fixture(scope="module", params=BUNDLED_DATABASES, ids=os.path.basename)
+def bundled_frames(request):
+    trial_df, keystate_df = _load_frames(request.param)
+    if trial_df.empty:
+        pytest.skip("no completed experimental trials")
+    return trial_df, keystate_df
+
+
+def _with_duplicate_trials(trial_df, every=3, score_change=None, new_instance=False):
+    """trial_df plus a later copy (new trial_id) of every `every`-th named trial."""
+    copies = trial_df[trial_df['global_trial_name'].notna()].iloc[::every].copy()
+    copies['trial_id'] = trial_df['trial_id'].max() + 1 + np.arange(len(copies))
+    if score_change is not None:
+        copies['score'] = copies['score'].fillna(0) + score_change
+    if new_instance:
+        copies['repeat_instance_index'] += 1
+    return pd.concat([trial_df, copies], ignore_index=True), set(copies['global_trial_name'])
+
+
+def _require_named_trials(trial_df):
+    # The pre-pilot databases never stored global_trial_name; their unnamed rows
+    # only go through the comparisons without injected trial duplicates
+    if trial_df['global_trial_name'].isna().all():
+        pytest.skip("no trials with a global_trial_name")
+
+
+def _with_duplicate_keystates(keystate_df, every=5, flip_f=False):
+    copies = keystate_df.iloc[::every].copy()
+    if flip_f:
+        copies['f_pressed'] = ~copies['f_pressed'].astype(bool)
+    return pd.concat([keystate_df, copies], ignore_index=True)
+
+
+def test_bundled_frames_without_injected_duplicates(bundled_frames):
+    trial_df, keystate_df = bundled_frames
+    names = set(trial_df['global_trial_name'].dropna())
+    for allowed in (set(), names):
+        assert_same_resolution(_reference_resolve_duplicate_trials, _resolve_duplicate_trials, trial_df, allowed)
+    assert_same_resolution(_reference_resolve_duplicate_keystates, _resolve_duplicate_keystates, keystate_df)
+
+
+@pytest.mark.parametrize("new_instance", [False, True])
+def test_bundled_frames_with_duplicate_trials(bundled_frames, new_instance):
+    trial_df, _ = bundled_frames
+    _require_named_trials(trial_df)
+    duplicated_df, duplicated_names = _with_duplicate_trials(trial_df, new_instance=new_instance)
+    half = set(sorted(duplicated_names)[::2])
+    for allowed in (set(), half, duplicated_names):
+        assert assert_same_resolution(_reference_resolve_duplicate_trials, _resolve_duplicate_trials,
+                                      duplicated_df, allowed) is None
+
+    # A scored copy next to an unscored original, and the reverse
+    unscored = trial_df.copy()
+    unscored['score'] = np.nan
+    for first, second in ((trial_df, unscored), (unscored, trial_df)):
+        mixed = pd.concat([first, second.assign(trial_id=second['trial_id'] + trial_df['trial_id'].max())],
+                          ignore_index=True)
+        for allowed in (set(), half):
+            assert_same_resolution(_reference_resolve_duplicate_trials, _resolve_duplicate_trials, mixed, allowed)
+
+
+def test_bundled_frames_with_conflicting_trial_scores(bundled_frames):
+    trial_df, _ = bundled_frames
+    _require_named_trials(trial_df)
+    # Unscored trials would not conflict with a scored copy
+    trial_df = trial_df.assign(score=trial_df['score'].fillna(0.0))
+    duplicated_df, duplicated_names = _with_duplicate_trials(trial_df, score_change=1.0)
+    # Not in repeat.csv, then in repeat.csv with the same repeat instance
+    for allowed in (set(), duplicated_names):
+        error = assert_same_resolution(_reference_resolve_duplicate_trials, _resolve_duplicate_trials,
+                                       duplicated_df, allowed)
+        assert error is not None and "Offending rows:" in error
+    # Different repeat instances of an allowed repeat do not conflict
+    duplicated_df, duplicated_names = _with_duplicate_trials(trial_df, score_change=1.0, new_instance=True)
+    assert assert_same_resolution(_reference_resolve_duplicate_trials, _resolve_duplicate_trials,
+                                  duplicated_df, duplicated_names) is None
+
+
+def test_bundled_frames_with_duplicate_keystates(bundled_frames):
+    _, keystate_df = bundled_frames
+    if keystate_df.empty:
+        pytest.skip("no keystates")
+    assert assert_same_resolution(_reference_resolve_duplicate_keystates, _resolve_duplicate_keystates,
+                                  _with_duplicate_keystates(keystate_df)) is None
+    error = assert_same_resolution(_reference_resolve_duplicate_keystates, _resolve_duplicate_keystates,
+                                   _with_duplicate_keystates(keystate_df, flip_f=True))
+    assert error is not None and "conflicting rows" in error
+
+
+# ---------------------------------------------------------------------------
+# Randomized frames
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize("seed", range(4))
+def test_random_frames(seed):
+    rng = np.random.default_rng(seed)
+    names = np.array(['T1', 'T2', 'T3', None, 'T4'], dtype=object)
+    score_pool = np.array([10.0, 20.0, np.nan])
+    for it in range(50):
+        n = int(rng.integers(0, 40))
+        if it % 2:
+            scores = score_pool[rng.integers(0, 3 if it % 3 == 0 else 2, n)]
+        else:
+            scores = np.where(rng.random(n) < .3, np.nan, 10.0)
+        trial_df = pd.DataFrame({
+            'trial_id': rng.permutation(np.arange(1, n + 1)),
+            'session_id': rng.integers(1, 4, n),
+            'trial_index': rng.integers(0, 5, n),
+            'global_trial_name': names[rng.integers(0, len(names), n)],
+            'score': scores,
+            'repeat_instance_index': rng.integers(0, 3, n),
+            'symmetry_transform': rng.integers(0, 8, n),
+        })
+        allowed = set(rng.choice(['T1', 'T2', 'T3', 'T4'], size=int(rng.integers(0, 4)), replace=False))
+        assert_same_resolution(_reference_resolve_duplicate_trials, _resolve_duplicate_trials, trial_df, allowed)
+
+        m = int(rng.integers(0, 60))
+        frames = rng.integers(0, 10, m).astype(float)
+        keystate_df = pd.DataFrame({
+            'frame': np.where(rng.random(m) < .1, np.nan, frames) if it % 5 == 0 else frames,
+            'f_pressed': rng.integers(0, 2, m) if it % 4 else np.ones(m, dtype=int),
+            'j_pressed': rng.integers(0, 2, m) if it % 4 else np.where(rng.random(m) < .2, np.nan, 0.0),
+            'trial_id': rng.integers(1, 5, m),
+        })
+        assert_same_resolution(_reference_resolve_duplicate_keystates, _resolve_duplicate_keystates, keystate_df)